@@ -6,15 +6,35 @@
 """Compute glacial inception threshold from global climatologies."""
 
 import argparse
+import calendar
+import concurrent.futures
+import contextlib
+import csv
+import fcntl
+import functools
+import glob
+import hashlib
+import importlib.util
+import json
 import os.path
+import platform
+import resource
+import shutil
+import sys
 import tempfile
-import subprocess
+import threading
+import time
 import warnings
 import cdsapi
+import dask.array
 import dask.diagnostics
 import dask.distributed
 import netCDF4
 import numpy as np
+import rasterio.enums
+import rasterio.transform
+import rasterio.windows
+import requests
 import scipy.special as sc
 import xarray as xr
 
@@ -22,7 +42,7 @@ import xarray as xr
 # Aggregate climatologies
 # -----------------------
 
-def aggregate_era5_avg(var='t2m', start=1981, end=2010):
+def aggregate_era5_avg(var='t2m', start=1981, end=2010, client=None):
     """Compute ERA5 multiyear monthly averages from monthly means."""
 
     # if file exists, return path
@@ -31,90 +51,252 @@ def aggregate_era5_avg(var='t2m', start=1981, end=2010):
     if os.path.isfile(filepath):
         return filepath
 
-    # compute monthly mean
+    # download missing yearly files concurrently
+    missing = [
+        year for year in range(start, end+1) if not os.path.isfile(
+            f'external/era5/monthly/era5.{var}.mon.{year:d}.nc')]
+    if missing:
+        with DownloadQueue(client=client) as queue:
+            futures = [
+                queue.submit(download_era5_monthly, year, var=var)
+                for year in missing]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+
+    # compose monthly mean from yearly files, each a partial sum
     print(f"Computing {filepath} ...")
-    paths = [
-        download_era5_monthly(year, var=var) for year in range(start, end+1)]
-    with xr.open_mfdataset(paths) as ds:
-        ds.groupby('time.month').mean().to_netcdf(
-            filepath, encoding={var: {'zlib': True}})
+    acc = MomentAccumulator()
+    for year in range(start, end+1):
+        with xr.open_dataset(download_era5_monthly(year, var=var)) as ds:
+            acc.update(ds[var].values[None])
+
+    # write average with coordinates from the first file
+    with xr.open_dataset(download_era5_monthly(start, var=var)) as ds:
+        template = ds[var].rename(time='month')
+        template['month'] = ds.time.dt.month.values
+        template.copy(data=acc.mean.astype(template.dtype)).to_dataset(
+            ).to_netcdf(filepath + '.part', encoding={var: {'zlib': True}})
+    os.replace(filepath + '.part', filepath)
 
     # return file path
     return filepath
 
 
-def aggregate_era5_std(freq='day', start=1981, end=2010):
+def aggregate_era5_std(
+        freq='day', start=1981, end=2010, tile=None, client=None):
     """Compute ERA5 multiyear monthly standard deviation from frequency."""
 
     # if file exists, return path
-    filepath = (
-        f'external/era5/clim/era5.t2m.{freq}.{start%100:d}{end%100:d}.std.nc')
+    filepath = get_era5_std_path(freq=freq, start=start, end=end, tile=tile)
     if os.path.isfile(filepath):
         return filepath
 
-    # compute monthly standard deviation
+    # list months missing partial moments
     func = {'day': download_era5_daily, 'hour': download_era5_hourly}[freq]
-    paths = [func(a, m) for m in range(1, 13) for a in range(start, end+1)]
-    with dask.distributed.Client():
-        with xr.open_mfdataset(paths, chunks={'latitude': 103}) as ds:
-            print(f"Computing {filepath} ...")
-            ds.groupby('time.month').std('time').to_netcdf(
-                filepath, encoding={'t2m': {'zlib': True}})
+    suffix = '' if tile is None else f'.{tile}'
+    missing = {
+        (year, month) for year in range(start, end+1)
+        for month in range(1, 13) if not os.path.isfile(
+            f'external/era5/moments/'
+            f'era5.t2m.{freq}.{year:d}.{month:02d}{suffix}.npz')}
+
+    # reduce months already on disk, no need for a CDS client
+    queued = {
+        (year, month) for year, month in missing if not os.path.isfile(
+            get_era5_path(year, month, freq=freq, tile=tile))}
+    for year, month in sorted(missing - queued):
+        aggregate_era5_moments(year, month, freq=freq, tile=tile)
+
+    # download other months concurrently, reducing each as it arrives
+    if queued:
+        with DownloadQueue(client=client) as queue:
+            futures = {
+                queue.submit(func, year, month, tile=tile): (year, month)
+                for year, month in sorted(queued)}
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+                aggregate_era5_moments(
+                    *futures[future], freq=freq, tile=tile)
+
+    # compose monthly moments from single-month partial moments
+    print(f"Computing {filepath} ...")
+    stdevs = []
+    for month in range(1, 13):
+        acc = MomentAccumulator()
+        for year in range(start, end+1):
+            acc.merge(MomentAccumulator.load(
+                aggregate_era5_moments(year, month, freq=freq, tile=tile)))
+        stdevs.append(acc.std())
+
+    # write standard deviation with coordinates from the first file
+    with xr.open_dataset(func(start, 1, tile=tile)) as ds:
+        template = ds.t2m.isel(time=0, drop=True)
+        std = xr.DataArray(
+            np.stack(stdevs).astype(template.dtype),
+            coords={'month': range(1, 13), **template.coords},
+            dims=('month',) + template.dims, attrs=template.attrs)
+        std.to_dataset(name='t2m').to_netcdf(
+            filepath + '.part', encoding={'t2m': {'zlib': True}})
+    os.replace(filepath + '.part', filepath)
 
     # return file path
     return filepath
 
 
+def aggregate_era5_moments(year, month, freq='day', tile=None, slab=24):
+    """Compute ERA5 single-month count, mean and M2 from frequency."""
+
+    # if file exists, return path
+    suffix = '' if tile is None else f'.{tile}'
+    filepath = (
+        f'external/era5/moments/'
+        f'era5.t2m.{freq}.{year:d}.{month:02d}{suffix}.npz')
+    if os.path.isfile(filepath):
+        return filepath
+
+    # stream a few time steps at a time
+    func = {'day': download_era5_daily, 'hour': download_era5_hourly}[freq]
+    acc = MomentAccumulator()
+    with xr.open_dataset(func(year, month, tile=tile)) as ds:
+        for i in range(0, ds.time.size, slab):
+            acc.update(ds.t2m.isel(time=slice(i, i+slab)).values)
+
+    # save accumulators and return file path
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    acc.save(filepath)
+    return filepath
+
+
+def get_era5_std_path(freq='day', start=1981, end=2010, tile=None):
+    """Get global ERA5 standard deviation path, or tile subset if missing."""
+    filepath = (
+        f'external/era5/clim/era5.t2m.{freq}.{start%100:d}{end%100:d}.std.nc')
+    if tile is None or os.path.isfile(filepath):
+        return filepath
+    return filepath[:-3] + f'.{tile}.nc'
+
+
+class MomentAccumulator():
+    """Accumulate count, mean and squared deviations in double precision.
+
+    Batches are merged with the parallel algorithm of Chan et al. (1979),
+    a generalization of Welford's online algorithm, cell by cell.
+    """
+
+    def __init__(self, count=0, mean=0, m2=0):
+        self.count = np.asarray(count, dtype='f8')
+        self.mean = np.asarray(mean, dtype='f8')
+        self.m2 = np.asarray(m2, dtype='f8')
+
+    def merge(self, other):
+        """Merge accumulators from another sample."""
+        total = self.count + other.count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(other.count > 0, other.mean-self.mean, 0)
+            self.mean = self.mean + np.where(
+                total > 0, delta*other.count/total, 0)
+            self.m2 = self.m2 + np.where(
+                other.count > 0,
+                other.m2 + delta**2*self.count*other.count/total, 0)
+        self.count = total
+
+    def update(self, values):
+        """Merge a batch of values with time on the first axis."""
+        values = np.asarray(values, dtype='f8')
+        count = np.sum(~np.isnan(values), axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(values, axis=0) / count
+        m2 = np.nansum((values-mean)**2, axis=0)
+        self.merge(MomentAccumulator(count, mean, m2))
+
+    def std(self):
+        """Return population standard deviation (ddof=0)."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, (self.m2/self.count)**0.5, np.nan)
+
+    def save(self, filepath):
+        """Save accumulators atomically."""
+        with open(filepath + '.part', 'wb') as binfile:
+            np.savez(binfile, count=self.count, mean=self.mean, m2=self.m2)
+        os.replace(filepath + '.part', filepath)
+
+    @classmethod
+    def load(cls, filepath):
+        """Load accumulators from file."""
+        with np.load(filepath) as npz:
+            return cls(**npz)
+
+
 # Download weather data
 # ---------------------
 
-def download_era5_daily(year, month):
-    """Download ERA5 daily means for a single month."""
+def get_era5_path(year, month, freq='day', tile=None):
+    """Get ERA5 daily or hourly means path for a single month."""
+    suffix = '' if tile is None else f'.{tile}'
+    dirname = {'day': 'daily', 'hour': 'hourly'}[freq]
+    return (
+        f'external/era5/{dirname}/'
+        f'era5.t2m.{freq}.{year:d}.{month:02d}{suffix}.nc')
+
+
+def download_era5_daily(year, month, tile=None, client=None):
+    """Download ERA5 daily means for a single month and optional tile."""
 
     # if file exists, return path
-    filepath = f'external/era5/daily/era5.t2m.day.{year:d}.{month:02d}.nc'
+    filepath = get_era5_path(year, month, freq='day', tile=tile)
     if os.path.isfile(filepath):
         return filepath
 
-    # query daily stats application
-    client = cdsapi.Client()
+    # query daily stats application, optionally on the tile area only
+    kwargs = {
+        'dataset': 'reanalysis-era5-single-levels',
+        'variable': '2m_temperature', 'statistic': 'daily_mean',
+        'year': f'{year:d}', 'month': f'{month:02d}'}
+    if tile is not None:
+        kwargs.update(area=get_tile_area(tile))
+    client = client or cdsapi.Client()
     result = client.service('tool.toolbox.orchestrator.workflow', params={
         'realm': 'user-apps', 'project': 'app-c3s-daily-era5-statistics',
-        'version': 'master', 'workflow_name': 'application', 'kwargs': {
-            'dataset': 'reanalysis-era5-single-levels',
-            'variable': '2m_temperature', 'statistic': 'daily_mean',
-            'year': f'{year:d}', 'month': f'{month:02d}'}})
+        'version': 'master', 'workflow_name': 'application',
+        'kwargs': kwargs})
 
     # download the result
     print(f"Downloading {filepath} ...")
-    client.download(result, [filepath])
+    client.download(result, [filepath + '.part'])
+    os.replace(filepath + '.part', filepath)
     return filepath
 
 
-def download_era5_hourly(year, month):
-    """Download ERA5 hourly means for a single month."""
+def download_era5_hourly(year, month, tile=None, client=None):
+    """Download ERA5 hourly means for a single month and optional tile."""
 
     # if file exists, return path
-    filepath = f'external/era5/hourly/era5.t2m.hour.{year:d}.{month:02d}.nc'
+    filepath = get_era5_path(year, month, freq='hour', tile=tile)
     if os.path.isfile(filepath):
         return filepath
 
+    # request existing days only, optionally on the tile area only
+    days = calendar.monthrange(year, month)[1]
+    request = {
+        'product_type': 'reanalysis', 'format': 'netcdf',
+        'variable': '2m_temperature',
+        'year': f'{year:d}', 'month': f'{month:02d}',
+        'day': [f'{i:02d}' for i in range(1, days+1)],
+        'time': [f'{i:02d}:00' for i in range(24)]}
+    if tile is not None:
+        request.update(area=get_tile_area(tile))
+
     # else retrieve the file
-    client = cdsapi.Client()
+    client = client or cdsapi.Client()
     client.retrieve(
-        'reanalysis-era5-single-levels', {
-            'product_type': 'reanalysis', 'format': 'netcdf',
-            'variable': '2m_temperature',
-            'year': f'{year:d}', 'month': f'{month:02d}',
-            'day': [f'{i:02d}' for i in range(1, 32)],
-            'time': [f'{i:02d}:00' for i in range(24)]},
-        filepath)
+        'reanalysis-era5-single-levels', request, filepath + '.part')
+    os.replace(filepath + '.part', filepath)
 
     # return filepath
     return filepath
 
 
-def download_era5_monthly(year, var='t2m'):
+def download_era5_monthly(year, var='t2m', client=None):
     """Download ERA5 monthly means for a single month."""
 
     # if file exists, return path
@@ -127,25 +309,130 @@ def download_era5_monthly(year, var='t2m'):
 
     # request download from CDS
     print(f"Downloading {filepath} ...")
-    client = cdsapi.Client()
+    client = client or cdsapi.Client()
     client.retrieve('reanalysis-era5-single-levels-monthly-means', {
         'format': 'netcdf', 'month': [f'{i}' for i in range(1, 13)],
         'product_type': 'monthly_averaged_reanalysis', 'time': '00:00',
-        'variable': variable, 'year': f'{year:d}'}, filepath)
+        'variable': variable, 'year': f'{year:d}'}, filepath + '.part')
+    os.replace(filepath + '.part', filepath)
     return filepath
 
 
+def get_tile_area(tile):
+    """Get CDS area, north, west, south, east, of a 30x30 degree tile."""
+    west, south, east, north = get_tile_bounds(tile)
+    return [north, west, south, east]
+
+
+class DownloadQueue():
+    """Keep several downloads in flight with one client and retries.
+
+    The CDS client is created on the first download, and only transport
+    errors are retried, so that configuration and programming errors
+    surface immediately.
+    """
+
+    retry = (requests.exceptions.RequestException, ConnectionError,
+             TimeoutError)
+
+    def __init__(self, jobs=4, client=None, retries=5, backoff=60):
+        self.client = client
+        self.lock = threading.Lock()
+        self.retries = retries
+        self.backoff = backoff
+        self.executor = concurrent.futures.ThreadPoolExecutor(jobs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.executor.shutdown()
+
+    def submit(self, func, *args, **kwargs):
+        """Submit a download function call and return a future path."""
+        return self.executor.submit(self.download, func, *args, **kwargs)
+
+    def get_client(self):
+        """Get the shared CDS client, created on first use."""
+        with self.lock:
+            if self.client is None:
+                self.client = cdsapi.Client()
+            return self.client
+
+    def download(self, func, *args, **kwargs):
+        """Call a download function, retrying with exponential backoff."""
+        client = self.get_client()
+        for attempt in range(self.retries):
+            try:
+                return func(*args, client=client, **kwargs)
+            except self.retry as error:
+                if attempt == self.retries - 1:
+                    raise
+                delay = self.backoff * 2**attempt
+                print(f"Retrying {func.__name__}{args} in {delay} s "
+                      f"after {error!r}")
+                time.sleep(delay)
+        return None
+
+
+class LocalClient():
+    """Stand-in for cdsapi.Client copying files from a local directory.
+
+    Requests are served by the file whose name matches the target, so that
+    download queues can be tested offline.
+    """
+
+    # pylint: disable=unused-argument
+
+    def __init__(self, root):
+        self.root = root
+
+    def retrieve(self, name, request, target):
+        """Copy file matching target name."""
+        self.download(None, [target])
+
+    def service(self, name, params):
+        """Return a placeholder result."""
+        return name
+
+    def download(self, result, targets):
+        """Copy files matching target names."""
+        for target in targets:
+            basename = os.path.basename(target).removesuffix('.part')
+            shutil.copyfile(os.path.join(self.root, basename), target)
+
+
 # Open input climatologies
 # ------------------------
 
-def open_climate_tile(tile, freq='day', source='cw5e5'):
+def get_climate_paths(tile, freq='day', source='cw5e5'):
+    """Get temp, prec, stdv climatology file paths for a 30x30 degree tile."""
+
+    # climatology from hyoga cache directory
+    prefix = os.path.join('~', '.cache', 'hyoga', source, 'clim', source)
+    prefix = os.path.expanduser(prefix)
+    paths = [
+        f'{prefix}.tas.mon.8110.avg.{tile}.nc',
+        f'{prefix}.pr.mon.8110.avg.{tile}.nc']
+
+    # matching or global standard deviation (see open_interp_stdev)
+    if source == 'cera5':
+        paths.append(get_era5_std_path(freq='day', tile=tile))
+    else:
+        paths.append(f'{prefix}.tas.mon.8110.std.{tile}.nc')
+
+    # return list of paths
+    return paths
+
+
+def open_climate_tile(tile, freq='day', source='cw5e5', chunks=None):
     """Open temp, prec, stdv climatology for a 30x30 degree tile."""
 
     # open climatology from hyoga cache directory
-    prefix = os.path.join('~', '.cache', 'hyoga', source, 'clim', source)
+    paths = get_climate_paths(tile, freq=freq, source=source)
     kwargs = {'chunks': {}, 'decode_coords': 'all'}
-    temp = xr.open_dataarray(f'{prefix}.tas.mon.8110.avg.{tile}.nc', **kwargs)
-    prec = xr.open_dataarray(f'{prefix}.pr.mon.8110.avg.{tile}.nc', **kwargs)
+    temp = xr.open_dataarray(paths[0], **kwargs)
+    prec = xr.open_dataarray(paths[1], **kwargs)
 
     # align coordinate names and values to cw5e5 data
     # FIXME do that in hyoga?
@@ -159,10 +446,11 @@ def open_climate_tile(tile, freq='day', source='cw5e5'):
         prec['lat'] = prec.lat.astype('f4')
         prec['lon'] = prec.lon.astype('f4')
 
-        # split cera5 file chunks
-        # FIXME why are they different?
-        temp = temp.chunk(month=1)
-        prec = prec.chunk(month=1)
+    # lay out planned spatial chunks once, with months in a single chunk
+    if chunks is not None:
+        temp, prec = (
+            da.chunk(month=-1, **get_chunk_sizes(da.sizes, chunks))
+            for da in (temp, prec))
 
     # convert units to degC and kg m-2 (per month)
     # FIXME assign cera5 units in hyoga, e.g.
@@ -184,20 +472,139 @@ def open_climate_tile(tile, freq='day', source='cw5e5'):
 
     # open matching or interpolated standard deviation
     if source == 'cera5':
-        stdv = open_interp_stdev(temp, freq=freq)
+        stdv = open_interp_stdev(temp, freq=freq, tile=tile)
     else:
-        stdv = xr.open_dataarray(
-            f'{prefix}.tas.mon.8110.std.{tile}.nc', **kwargs)
+        stdv = xr.open_dataarray(paths[2], **kwargs)
+        if chunks is not None:
+            stdv = stdv.chunk(**temp.chunksizes)
 
     # return temperature, precipitation, standard deviation
     return temp, prec, stdv
 
 
-def open_interp_stdev(temp, freq='day'):
+def open_cached_climate_tile(tile, freq='day', source='cw5e5', chunks=100):
+    """Open normalized climatology from a memory-mapped tile cache."""
+
+    # bypass the cache until all upstream files exist
+    paths = get_climate_paths(tile, freq=freq, source=source)
+    if not all(os.path.isfile(path) for path in paths):
+        return open_climate_tile(
+            tile, freq=freq, source=source, chunks=chunks)
+
+    # key cache entries on source, tile, freq and upstream files
+    key = {'source': source, 'tile': tile, 'freq': freq}
+    key['inputs'] = {
+        path: [os.stat(path).st_mtime, os.stat(path).st_size]
+        for path in paths}
+    key = hashlib.sha256(json.dumps(key, sort_keys=True).encode())
+    prefix = f'processed/cache/{source}.{freq}.{tile}'
+    dirname = f'{prefix}.{key.hexdigest()[:16]}'
+
+    # populate cache with lat, lon, month arrays, atomically renamed
+    if not os.path.isdir(dirname):
+        print(f"Caching {dirname} ...")
+        os.makedirs('processed/cache', exist_ok=True)
+        tmpdir = tempfile.mkdtemp(dir='processed/cache', prefix=f'{tile}.')
+        meta = {}
+        for name, da in zip(
+                ('temp', 'prec', 'stdv'),
+                open_climate_tile(tile, freq=freq, source=source)):
+            da = da.transpose('lat', 'lon', 'month')
+            np.save(os.path.join(tmpdir, f'{name}.npy'), da.values)
+            meta[name] = {'name': da.name, 'attrs': da.attrs}
+            da.close()
+        for dim in ('lat', 'lon', 'month'):
+            np.save(os.path.join(tmpdir, f'{dim}.npy'), da[dim].values)
+        with open(
+                os.path.join(tmpdir, 'meta.json'), 'w',
+                encoding='utf-8') as jsonfile:
+            json.dump(meta, jsonfile, default=lambda obj: obj.tolist())
+        try:
+            os.rename(tmpdir, dirname)
+        except OSError:  # another process was faster
+            shutil.rmtree(tmpdir)
+
+        # remove entries invalidated by upstream changes
+        for stale in glob.glob(f'{prefix}.*'):
+            if stale != dirname:
+                print(f"Removing {stale} ...")
+                shutil.rmtree(stale, ignore_errors=True)
+
+    # memory-map arrays in spatial chunks with months in a single chunk,
+    # each task reading its own block so that graphs only hold file paths
+    coords = {
+        dim: np.load(os.path.join(dirname, f'{dim}.npy'))
+        for dim in ('lat', 'lon', 'month')}
+    with open(
+            os.path.join(dirname, 'meta.json'), encoding='utf-8') as jsonfile:
+        meta = json.load(jsonfile)
+    arrays = []
+    for name in ('temp', 'prec', 'stdv'):
+        filepath = os.path.join(dirname, f'{name}.npy')
+        data = np.load(filepath, mmap_mode='r')
+        sizes = get_chunk_sizes(dict(zip(('lat', 'lon'), data.shape)), chunks)
+        data = dask.array.map_blocks(
+            read_cached_block, filepath, dtype=data.dtype,
+            meta=np.empty((0, 0, 0), dtype=data.dtype),
+            chunks=dask.array.core.normalize_chunks(
+                (sizes['lat'], sizes['lon'], -1), shape=data.shape))
+        arrays.append(xr.DataArray(
+            data, coords=coords, dims=['lat', 'lon', 'month'],
+            name=meta[name]['name'], attrs=meta[name]['attrs']))
+
+    # return temperature, precipitation, standard deviation
+    return tuple(arrays)
+
+
+def read_cached_block(filepath, block_info=None):
+    """Read one block of a memory-mapped tile cache array."""
+    (lat0, lat1), (lon0, lon1), _ = block_info[None]['array-location']
+    return np.load(filepath, mmap_mode='r')[lat0:lat1, lon0:lon1]
+
+
+def plan_chunks(
+        memory='1GiB', interp=73, integration='riemann', order=1,
+        kernel='fused', sweep=True, dtype='f8'):
+    """Plan spatial chunk size for a memory budget per worker thread."""
+
+    # count bytes per cell of monthly and interpolated inputs
+    days, _ = get_integration_nodes(
+        interp=interp, integration=integration, order=order)
+    offsets = get_temperature_offsets().size
+    itemsize = np.dtype(dtype).itemsize
+    cell = 3 * (12 + days.size) * itemsize
+
+    # add block kernel copies of gathered cells with days first
+    if kernel == 'fused' or not sweep:
+        cell += 6 * days.size * itemsize
+
+    # add daily balance temporaries over the offset and day broadcast
+    else:
+        cell += 4 * offsets * days.size * itemsize
+
+    # add mass balance curves and their sign for the threshold sweep
+    if sweep:
+        cell += 2 * offsets * itemsize
+
+    # keep headroom for input and output blocks held by the scheduler
+    memory = dask.utils.parse_bytes(memory)
+    return max(int((memory/2/cell)**0.5), 1)
+
+
+def get_chunk_sizes(sizes, chunks=100):
+    """Get balanced spatial chunk sizes not exceeding the planned size."""
+    balanced = {}
+    for dim in ('lat', 'lon'):
+        count = -(-sizes[dim] // chunks)
+        balanced[dim] = -(-sizes[dim] // count)
+    return balanced
+
+
+def open_interp_stdev(temp, freq='day', tile=None):
     """Open interpolated ERA5 standard deviation."""
 
-    # open era5 standard deviation
-    filepath = aggregate_era5_std(freq='day')
+    # open global era5 standard deviation, or the tile subset if missing
+    filepath = aggregate_era5_std(freq='day', tile=tile)
     da = xr.open_dataarray(filepath, chunks={})
 
     # align coordinate names and values to cw5e5
@@ -207,80 +614,348 @@ def open_interp_stdev(temp, freq='day'):
         da = da.rename(longitude='lon', latitude='lat')
         # da['lon'] = (da.lon + 180) % 360 - 180  # still needed?
 
-    # interpolate (for larger grids use map_blocks as interp loads all chunks
-    # overloading the memory https://github.com/pydata/xarray/issues/6799)
-    # stdv = temp.map_blocks(lambda array: da.interp_like(array), template=temp)
-    stdv = da.interp_like(temp).chunk(**temp.chunksizes)
+    # get separable bilinear weights on a window around the tile (interp_like
+    # loads all chunks https://github.com/pydata/xarray/issues/6799)
+    lat, wlat = get_regrid_weights(
+        tuple(da.lat.values), tuple(temp.lat.values))
+    lon, wlon = get_regrid_weights(
+        tuple(da.lon.values), tuple(temp.lon.values))
+    wlat = xr.DataArray(wlat, coords={'lat': temp.lat}, dims=['lat', 'y'])
+    wlon = xr.DataArray(wlon, coords={'lon': temp.lon}, dims=['lon', 'x'])
+
+    # regrid the window block-wise as a tensor product
+    da = da.isel(lat=lat, lon=lon).rename(lat='y', lon='x')
+    stdv = xr.dot(wlat, da.drop_vars(['y', 'x']), wlon, dim=['y', 'x'])
+    stdv = stdv.transpose(*temp.dims).chunk(**temp.chunksizes)
 
     # return interpolated standard deviation
     return stdv
 
 
+@functools.lru_cache
+def get_regrid_weights(source, target):
+    """Get linear interpolation weights from a source window to a grid."""
+
+    # find the source window bracketing all target points
+    source, target = np.array(source), np.array(target)
+    ascending = np.sort(source)
+    lower = np.searchsorted(ascending, target.min(), side='right') - 1
+    upper = np.searchsorted(ascending, target.max(), side='left') + 1
+    window = np.isin(source, ascending[max(lower, 0):upper]).nonzero()[0]
+    window = slice(window.min(), window.max()+1)
+
+    # interpolate each source point's indicator, nan outside the source
+    source = source[window]
+    order = np.argsort(source)
+    identity = np.eye(source.size)[order]
+    weights = np.stack([
+        np.interp(
+            target, source[order], column, left=np.nan, right=np.nan)
+        for column in identity.T], axis=1)
+    weights.flags.writeable = False
+
+    # return source window and read-only (target, source) weights
+    return window, weights
+
+
 # Compute main outputs
 # --------------------
 
-def compute_interp_climate(array, interp=73):
+def compute_interp_climate(
+        array, interp=73, integration='riemann', order=1, dtype='f8'):
     """Compute interpolated climate on multiday resolution."""
 
+    # get cached month to day interpolation weights
+    days, _ = get_integration_nodes(
+        interp=interp, integration=integration, order=order)
+    weights = get_interp_weights(
+        interp=interp, integration=integration, order=order)
+    weights = xr.DataArray(
+        weights.astype(dtype), coords={'day': days}, dims=['day', 'month'])
+
+    # interpolate to sub-monthly resolution as a matrix product on each
+    # block, keeping chunks as laid out (dask einsum would split them)
+    attrs = array.attrs
+    array = xr.apply_ufunc(
+        np.matmul, array.astype(dtype).drop_vars('month'), weights,
+        input_core_dims=[['month'], ['month', 'day']],
+        output_core_dims=[['day']], dask='parallelized',
+        output_dtypes=[dtype])
+    array = array.assign_attrs(attrs)
+
+    # return interpolated array
+    return array
+
+
+@functools.lru_cache
+def get_integration_nodes(interp=73, integration='riemann', order=1):
+    """Get multiday integration nodes and weights in days."""
+
+    # regular steps for a Riemann sum over the year
+    if integration == 'riemann':
+        days = np.linspace(0, 365, interp+1)[:-1]
+        weights = np.full(interp, 365/interp)
+
+    # Gauss-Legendre nodes on each segment between the middle of months,
+    # where the interpolated climate is linear in time
+    elif integration == 'quadrature':
+        months = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+        knots = months.cumsum() - months[0]/2
+        lower = knots[:, None]
+        upper = np.append(knots[1:], knots[0]+365)[:, None]
+        nodes, weights = np.polynomial.legendre.leggauss(order)
+        days = ((lower+upper)/2 + (upper-lower)/2*nodes).ravel()
+        weights = ((upper-lower)/2*weights).ravel()
+
+    # other integration methods are not implemented
+    else:
+        raise ValueError(f"Invalid integration method {integration}")
+
+    # return read-only days and weights
+    days.flags.writeable = False
+    weights.flags.writeable = False
+    return days, weights
+
+
+@functools.lru_cache
+def get_interp_weights(interp=73, integration='riemann', order=1):
+    """Get linear interpolation weights from months to multiday nodes."""
+
     # add a day coordinate corresponding to middle of each month
     months = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
-    array = array.swap_dims({'month': 'day'}).drop_vars('month')
-    array = array.assign_coords(day=months.cumsum()-months[0]/2)
+    knots = months.cumsum() - months[0]/2
 
     # add zeroth and thirteenth months for periodicity
-    before = array.isel(day=-1).assign_coords(day=array.day[0]-31)
-    after = array.isel(day=0).assign_coords(day=array.day[-1]+31)
-    array = xr.concat((before, array, after), 'day')
+    knots = np.concatenate(([knots[0]-31], knots, [knots[-1]+31]))
+    identity = np.eye(12)
+    identity = np.vstack((identity[-1], identity, identity[0]))
 
-    # interpolate to sub-monthly resolution
-    array = array.interp(day=np.linspace(0, 365, interp+1)[:-1])
+    # interpolate each month's indicator to sub-monthly resolution
+    days, _ = get_integration_nodes(
+        interp=interp, integration=integration, order=order)
+    weights = np.stack(
+        [np.interp(days, knots, column) for column in identity.T], axis=1)
+    weights.flags.writeable = False
 
-    # return interpolated array
-    return array
+    # return read-only (day, month) weights
+    return weights
 
 
-def compute_mass_balance(
-        temp, prec, stdv, ddf=3, interp=73, method='linear', precip='cp'):
-    """Compute mass balance from climatology."""
+@functools.lru_cache
+def get_segment_weights(interp=73, integration='riemann', order=1):
+    """Get integration weights summed over each segment between months."""
 
-    # intepolate chunked climatology
-    temp = compute_interp_climate(temp.chunk(lat=100, lon=100), interp=interp)
-    prec = compute_interp_climate(prec.chunk(lat=100, lon=100), interp=interp)
-    stdv = compute_interp_climate(stdv.chunk(lat=100, lon=100), interp=interp)
+    # index segments by the month at their start, december wraps to january
+    months = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+    knots = months.cumsum() - months[0]/2
+    days, weights = get_integration_nodes(
+        interp=interp, integration=integration, order=order)
+    segments = (np.searchsorted(knots, days, side='right') - 1) % 12
+
+    # sum node weights on each segment
+    weights = np.bincount(segments, weights=weights, minlength=12)
+    weights.flags.writeable = False
+
+    # return read-only segment weights
+    return weights
+
+
+def compute_interp_inputs(
+        temp, prec, stdv, interp=73, integration='riemann', order=1,
+        dtype='f8'):
+    """Compute chunked interpolated inputs unless already interpolated."""
+
+    # interpolate monthly climatology in the spatial chunks laid out at
+    # open time (see plan_chunks), keeping days in a single chunk
+    if 'month' in temp.dims:
+        temp, prec, stdv = (
+            compute_interp_climate(
+                da, interp=interp, integration=integration, order=order,
+                dtype=dtype)
+            for da in (temp, prec, stdv))
+        temp, prec, stdv = (da.chunk(day=-1) for da in (temp, prec, stdv))
+
+    # return interpolated temperature, precipitation and stdev
+    return temp, prec, stdv
+
+
+def compute_candidate_mask(
+        temp, prec, stdv, ddf=3, method='linear', precip='cp',
+        bounds=(-5, 20), interp=73, integration='riemann', order=1):
+    """Compute mask of cells that may have a threshold within bounds."""
+
+    # bound climate on each segment between consecutive months, where
+    # interpolated climate lies between the values at both ends (rolled
+    # block-wise because dask roll concatenates and rechunks months)
+    def following(da):
+        return xr.apply_ufunc(
+            np.roll, da, input_core_dims=[['month']],
+            output_core_dims=[['month']], dask='parallelized',
+            output_dtypes=[da.dtype], kwargs={'shift': -1, 'axis': -1})
+
+    def lower(da):
+        return np.minimum(da, following(da))
+
+    def upper(da):
+        return np.maximum(da, following(da))
+
+    # apply the warmest offset, any threshold needs positive balance there
+    offset = bounds[1]
+    temp = lower(temp) - offset
+    prec = upper(prec)
+    if precip == 'pp':
+        prec = prec * np.exp(-0.169/2.4*offset)
+
+    # upper bound on snow accumulation, decreasing with temperature
+    median = 1  # temperature at which half of rain falls as snow
+    dispersion = 1  # half of range in which some rain falls as snow
+    if method == 'linear':
+        snow = prec * (0.5-(temp-median)/(2*dispersion)).clip(0, 1)
+    elif method == 'stdv':
+        snow = prec * 0.5*np.maximum(
+            sc.erfc((temp-median)/(2**0.5*lower(stdv))),
+            sc.erfc((temp-median)/(2**0.5*upper(stdv))))
+    else:
+        raise ValueError(f"Invalid snow fraction method {method}")
+
+    # lower bound on melt, effective temperature exceeds positive part
+    melt = ddf * temp.clip(min=0)
+
+    # upper bound on annual mass balance, missing data are not candidates
+    weights = get_segment_weights(
+        interp=interp, integration=integration, order=order)
+    weights = xr.DataArray(weights, dims=['month'])
+    smb = ((snow-melt)*weights).sum('month', skipna=False)
+
+    # return candidate cells mask
+    mask = (smb > 0).rename('mask')
+    return mask
+
+
+def compute_daily_balance(
+        temp, prec, stdv, offset, ddf=3, method='linear', precip='cp',
+        lookup=False):
+    """Compute daily surface mass balance for given temperature offsets."""
 
     # apply temperature offset
-    offset = np.linspace(-5, 20, 126)
-    offset = xr.DataArray(offset, coords=[offset], dims=['offset'])
     temp = temp - offset
 
     # apply precipitation scaling
     if precip == 'pp':
         prec = prec * np.exp(-0.169/2.4*offset)
 
+    # use exact or tabulated special functions
+    erfc = get_lookup_table('erfc') if lookup else sc.erfc
+    func = get_lookup_table('teff') if lookup else calov_greve
+
     # compute snow accumulation in kg m-2 day-1
-    method = 'linear'
     median = 1  # temperature at which half of rain falls as snow
     dispersion = 1  # half of range in which some rain falls as snow
     if method == 'linear':  # classic piecewise-linear method
         snow = prec * (0.5-(temp-median)/(2*dispersion)).clip(0, 1)
     elif method == 'stdv':  # creative error-function method
-        snow = prec * 0.5*sc.erfc((temp-median)/(2**0.5*stdv))
+        snow = prec * 0.5*erfc((temp-median)/(2**0.5*stdv))
     else:
         raise ValueError(f"Invalid snow fraction method {method}")
 
     # compute effective temperature and melt in kg m-2 day-1
     norm = temp / (2**0.5*stdv)
-    teff = (stdv/2**0.5) * (np.exp(-norm**2)/np.pi**0.5 + norm*sc.erfc(-norm))
+    teff = (stdv/2**0.5) * func(norm)
     melt = ddf * teff  # ddf is in kg m-2 K-1 day-1 (~mm w.e. K-1 day-1)
 
-    # integrate surface mass balance in kg m-2
-    smb = (snow - melt).sum('day') * 365 / interp
-    smb = smb.transpose('offset', 'lat', 'lon')
+    # return daily surface mass balance in kg m-2 day-1
+    return snow - melt
+
+
+def compute_mass_balance(
+        temp, prec, stdv, ddf=3, interp=73, method='linear', precip='cp',
+        kernel='fused', integration='riemann', order=1, lookup=False,
+        dtype='f8', mask=None):
+    """Compute mass balance from climatology."""
+
+    # intepolate chunked climatology
+    kwargs = {'interp': interp, 'integration': integration, 'order': order}
+    temp, prec, stdv = compute_interp_inputs(
+        temp, prec, stdv, dtype=dtype, **kwargs)
+    _, weights = get_integration_nodes(**kwargs)
+    weights = weights.astype(dtype)
+
+    # prepare temperature offsets
+    offset = get_temperature_offsets()
+    offset = xr.DataArray(offset, coords=[offset], dims=['offset'])
+
+    # integrate surface mass balance in kg m-2 one offset at a time
+    if kernel == 'fused':
+        inputs, kwargs = get_kernel_inputs(temp, prec, stdv, mask=mask)
+        smb = xr.apply_ufunc(
+            sweep_mass_balance, *inputs, dask='parallelized',
+            input_core_dims=[['day'], ['day'], ['day'], []][:len(inputs)],
+            output_core_dims=[['offset']], output_dtypes=[temp.dtype],
+            dask_gufunc_kwargs={'output_sizes': {'offset': offset.size}},
+            kwargs={
+                'offsets': offset.values.astype(dtype), 'weights': weights,
+                'ddf': ddf, 'method': method, 'precip': precip,
+                'lookup': lookup, **kwargs})
+        smb = smb.assign_coords(offset=offset)
+
+    # integrate surface mass balance in kg m-2 over the broadcast cube
+    elif kernel == 'xarray':
+        smb = compute_daily_balance(
+            temp, prec, stdv, offset.astype(dtype), ddf=ddf, method=method,
+            precip=precip, lookup=lookup)
+        smb = xr.dot(smb, xr.DataArray(weights, dims=['day']), dim='day')
+        if mask is not None:
+            smb = smb.where(mask)
+
+    # other kernels are not implemented
+    else:
+        raise ValueError(f"Invalid mass balance kernel {kernel}")
 
     # return surface mass balance
+    smb = smb.transpose('offset', ...)
     return smb
 
 
+def get_temperature_offsets():
+    """Get temperature offsets swept by the mass balance in K."""
+    return np.linspace(-5, 20, 126)
+
+
+def compute_bisect_threshold(
+        temp, prec, stdv, ddf=3, interp=73, method='linear', precip='cp',
+        bounds=(-5, 20), tolerance=0.01, integration='riemann', order=1,
+        lookup=False, dtype='f8', mask=None):
+    """Compute glacial inception threshold by bisection of mass balance."""
+
+    # intepolate chunked climatology
+    kwargs = {'interp': interp, 'integration': integration, 'order': order}
+    temp, prec, stdv = compute_interp_inputs(
+        temp, prec, stdv, dtype=dtype, **kwargs)
+    _, weights = get_integration_nodes(**kwargs)
+
+    # bisect mass balance zero crossing independently on each chunk
+    inputs, kwargs = get_kernel_inputs(temp, prec, stdv, mask=mask)
+    git = xr.apply_ufunc(
+        bisect_threshold, *inputs, dask='parallelized',
+        input_core_dims=[['day'], ['day'], ['day'], []][:len(inputs)],
+        output_dtypes=[temp.dtype], kwargs={
+            'weights': weights.astype(dtype), 'ddf': ddf, 'method': method,
+            'precip': precip, 'lookup': lookup, 'bounds': bounds,
+            'tolerance': tolerance, **kwargs})
+    git = git.rename('git')
+    git.attrs.update(long_name='glacial inception threshold', units='K')
+
+    # return glacial inception threshold
+    return git
+
+
+def get_kernel_inputs(temp, prec, stdv, mask=None):
+    """Get block kernel inputs, passing a missing mask as keyword."""
+    if mask is None:
+        return (temp, prec, stdv), {'mask': None}
+    return (temp, prec, stdv, mask), {}
+
+
 def compute_glacial_threshold(smb):
     """Compute glacial inception threshold from surface mass balance."""
 
@@ -299,9 +974,1104 @@ def compute_glacial_threshold(smb):
     return git
 
 
+def compute_ensemble(
+        temp, prec, stdv, products, threshold=None, tolerance=0.01,
+        kernel='fused', interp=73, integration='riemann', order=1,
+        lookup=False, dtype='f8', masks=None):
+    """Compute glacial inception thresholds for a parameter ensemble."""
+
+    # interpolate climatology once for all parameter combinations
+    kwargs = {
+        'interp': interp, 'integration': integration, 'order': order,
+        'dtype': dtype}
+    temp, prec, stdv = compute_interp_inputs(temp, prec, stdv, **kwargs)
+
+    # compute one threshold per product from shared inputs
+    gits = []
+    masks = masks or [None] * len(products)
+    for params, mask in zip(products, masks):
+
+        # skip computation if no cell can have a threshold
+        if mask is not None and not mask.any():
+            git = xr.full_like(mask, np.nan, dtype=dtype).rename('git')
+            git.attrs.update(
+                long_name='glacial inception threshold', units='K')
+            gits.append(git)
+            continue
+
+        # lay out computed masks in the spatial chunks of the inputs
+        if mask is not None:
+            mask = mask.chunk({dim: temp.chunksizes[dim] for dim in mask.dims})
+
+        # bisection assumes mass balance is monotonic, only true for cp
+        engine = threshold
+        if engine is None:
+            engine = 'bisect' if params['precip'] == 'cp' else 'sweep'
+        if engine == 'bisect':
+            git = compute_bisect_threshold(
+                temp, prec, stdv, tolerance=tolerance, lookup=lookup,
+                mask=mask, **params, **kwargs)
+        else:
+            smb = compute_mass_balance(
+                temp, prec, stdv, kernel=kernel, lookup=lookup, mask=mask,
+                **params, **kwargs)
+            git = compute_glacial_threshold(smb)
+        gits.append(git)
+
+    # return list of glacial inception thresholds
+    return gits
+
+
+# Lookup tables
+# -------------
+
+class LookupTable():
+    """Tabulate a function for linear interpolation on a regular grid."""
+
+    def __init__(self, func, start, stop, rtol=1e-4, bounds=(None, None)):
+        """Refine the grid until the relative error is below rtol.
+
+        The error bound only holds on [start, stop]. Beyond, values are
+        extrapolated linearly and the relative error can reach 1, e.g. for
+        teff below -4.
+        """
+        self.start = start
+        self.stop = stop
+        self.bounds = bounds
+        self.error = np.inf
+        size = 64
+        while self.error > rtol:
+            size *= 2
+            grid = np.linspace(start, stop, size+1)
+            self.step = grid[1] - grid[0]
+            self.values = func(grid)
+            self.slopes = np.diff(self.values)
+
+            # linear interpolation error peaks near the middle of intervals
+            check = (grid[:-1, None] + self.step*np.linspace(0, 1, 9)).ravel()
+            exact = func(check)
+            self.error = np.max(abs(self(check)-exact) / abs(exact))
+
+    def __call__(self, x):
+        """Interpolate tabulated values, extrapolating linearly."""
+
+        # apply on numpy blocks of xarray objects
+        if isinstance(x, xr.DataArray):
+            return xr.apply_ufunc(
+                self, x, dask='parallelized', output_dtypes=[x.dtype])
+
+        # locate grid interval, keeping the input precision, missing values
+        # use the first interval and propagate through the fraction
+        x = np.asarray(x)
+        index = (x - x.dtype.type(self.start)) / x.dtype.type(self.step)
+        lower = np.clip(np.floor(np.nan_to_num(index)), 0, self.slopes.size-1)
+        fraction = index - lower
+        lower = lower.astype(np.intp)
+
+        # interpolate and clip to function bounds
+        values = self.values.astype(x.dtype, copy=False)
+        slopes = self.slopes.astype(x.dtype, copy=False)
+        result = values[lower] + fraction*slopes[lower]
+        if self.bounds != (None, None):
+            result = np.clip(result, *self.bounds)
+        return result
+
+
+def calov_greve(norm):
+    """Compute normalized effective temperature of Calov and Greve (2005)."""
+    return np.exp(-norm**2)/np.pi**0.5 + norm*sc.erfc(-norm)
+
+
+@functools.lru_cache
+def get_lookup_table(name):
+    """Get tabulated effective temperature or error function."""
+    if name == 'teff':  # ~0 below -4 and ~2x above 8 where we extrapolate
+        return LookupTable(calov_greve, -4, 8, bounds=(0, None))
+    if name == 'erfc':  # ~2 below -4 and ~0 above 4
+        return LookupTable(sc.erfc, -4, 4, bounds=(0, 2))
+    raise ValueError(f"Invalid lookup table {name}")
+
+
+# Block kernels
+# -------------
+
+def integrate_balance(
+        temp, prec, stdv, offset, weights, ddf=3, method='linear',
+        precip='cp', lookup=False):
+    """Integrate annual mass balance with days on first axis."""
+
+    # accumulate weighted daily mass balance in place, never storing days
+    shape = np.broadcast_shapes(temp.shape[1:], np.shape(offset))
+    smb = np.zeros(shape, dtype=temp.dtype)
+    for day, weight in enumerate(weights):
+        smb += weight * compute_daily_balance(
+            temp[day], prec[day], stdv[day], offset, ddf=ddf, method=method,
+            precip=precip, lookup=lookup)
+
+    # return annual surface mass balance in kg m-2
+    return smb
+
+
+def sweep_mass_balance(temp, prec, stdv, mask, offsets, weights, **kwargs):
+    """Compute mass balance for each offset with days on last axis."""
+
+    # gather candidate cells and move days to a contiguous first axis
+    if mask is not None:
+        temp, prec, stdv = gather_cells(mask, temp, prec, stdv)
+    temp, prec, stdv = (
+        np.moveaxis(a, -1, 0).copy() for a in (temp, prec, stdv))
+
+    # preallocate output and stream offsets one slab at a time
+    smb = np.empty(temp.shape[1:] + (len(offsets),), dtype=temp.dtype)
+    for i, offset in enumerate(offsets):
+        smb[..., i] = integrate_balance(
+            temp, prec, stdv, offset, weights, **kwargs)
+
+    # return surface mass balance with offsets on last axis
+    if mask is not None:
+        smb = scatter_cells(mask, smb, fill=np.nan)
+    return smb
+
+
+def bisect_threshold(
+        temp, prec, stdv, mask, weights, ddf=3, method='linear',
+        precip='cp', lookup=False, bounds=(-5, 20), tolerance=0.01):
+    """Bisect inception threshold on numpy arrays with days on last axis."""
+
+    # gather candidate cells and move days to a contiguous first axis
+    if mask is not None:
+        temp, prec, stdv = gather_cells(mask, temp, prec, stdv)
+    temp, prec, stdv = (
+        np.moveaxis(a, -1, 0).copy() for a in (temp, prec, stdv))
+
+    # annual surface mass balance for an array of temperature offsets
+    def balance(offset):
+        return integrate_balance(
+            temp, prec, stdv, offset, weights, ddf=ddf, method=method,
+            precip=precip, lookup=lookup)
+
+    # find cells with a zero crossing using sweep conventions
+    glaciated = balance(bounds[0]) > 0
+    crossing = balance(bounds[1]) > 0
+    git = np.full(crossing.shape, np.nan, dtype=temp.dtype)
+    git[glaciated & crossing] = -bounds[0]
+
+    # only bisect cells whose zero crossing is inside the bracket
+    active = crossing & ~glaciated
+    temp, prec, stdv = (a[:, active] for a in (temp, prec, stdv))
+    lower = np.full(temp.shape[1:], bounds[0], dtype=temp.dtype)
+    upper = np.full(temp.shape[1:], bounds[1], dtype=temp.dtype)
+
+    # halve the bracket until the midpoint is within tolerance
+    for _ in range(int(np.ceil(np.log2((bounds[1]-bounds[0])/tolerance)))):
+        middle = (lower+upper) / 2
+        positive = balance(middle) > 0
+        lower = np.where(positive, lower, middle)
+        upper = np.where(positive, middle, upper)
+    git[active] = -(lower+upper)/2
+
+    # return glacial inception threshold
+    if mask is not None:
+        git = scatter_cells(mask, git, fill=np.nan)
+    return git
+
+
+def gather_cells(mask, *arrays):
+    """Gather masked cells of arrays into a compressed (cell, day) layout."""
+    mask = np.broadcast_to(mask, arrays[0].shape[:-1])
+    return tuple(array[mask] for array in arrays)
+
+
+def scatter_cells(mask, values, fill=np.nan):
+    """Scatter compressed cell values back into the block layout."""
+    output = np.full(mask.shape + values.shape[1:], fill, dtype=values.dtype)
+    output[mask] = values
+    return output
+
+
+# Report accuracy
+# ---------------
+
+def compute_integration_error(temp, prec, stdv, stride=10, **kwargs):
+    """Compute threshold error against a Riemann sum on a cell subsample."""
+
+    # subsample input climatology
+    temp, prec, stdv = (
+        da.isel(lat=slice(None, None, stride), lon=slice(None, None, stride))
+        for da in (temp, prec, stdv))
+
+    # compute thresholds with chosen and reference integration
+    git = compute_bisect_threshold(temp, prec, stdv, **kwargs)
+    kwargs.update(integration='riemann')
+    ref = compute_bisect_threshold(temp, prec, stdv, **kwargs)
+
+    # return absolute threshold error
+    return abs(git - ref)
+
+
+def report_threshold_diff(tiles, paths, refpaths, filepath):
+    """Write per-tile threshold differences against reference tiles."""
+
+    # write one line per tile with a matching reference
+    with open(filepath, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['tile', 'max_abs_diff', 'mean_abs_diff', 'nan_diff'])
+        for tile, path, refpath in zip(tiles, paths, refpaths):
+            if not os.path.exists(refpath):
+                continue
+
+            # compute absolute threshold differences in double precision
+            with (
+                    open_tile_threshold(tile, path) as git,
+                    open_tile_threshold(tile, refpath) as ref):
+                diff = abs(git.astype('f8') - ref.astype('f8'))
+                nans = int((git.isnull() ^ ref.isnull()).sum())
+                writer.writerow([
+                    tile, float(diff.max()), float(diff.mean()), nans])
+
+
+# Schedule tiles
+# --------------
+
+def build_tile(
+        tile, todo, source='cw5e5', freq='day', mask=True, curves=False,
+        profiler=None, chunks=100, **kwargs):
+    """Build lazy threshold product writes for a single tile."""
+
+    # open climate once for all products
+    profiler = profiler or Profiler(enabled=False)
+    for _, tilepath in todo:
+        print(f"Computing {get_tile_label(tile, tilepath)} ...")
+    with profiler.stage('open', tile):
+        temp, prec, stdv = open_cached_climate_tile(
+            tile, freq=freq, source=source, chunks=chunks)
+    products = [params for params, _ in todo]
+
+    # classify candidate cells from the small monthly climatology
+    masks = None
+    if mask:
+        with profiler.stage('mask', tile), profiler.tasks(tile):
+            masks = dask.compute(*(
+                compute_candidate_mask(
+                    temp, prec, stdv, interp=kwargs.get('interp', 73),
+                    integration=kwargs.get('integration', 'riemann'),
+                    order=kwargs.get('order', 1), **params)
+                for params in products))
+
+    # interpolate climate and compute thresholds on candidate cells
+    with profiler.stage('graph', tile):
+        gits = compute_ensemble(
+            temp, prec, stdv, products, masks=masks, **kwargs)
+
+        # compute mass balance curves on all cells if requested
+        smbs = [None] * len(products)
+        if curves:
+            options = {
+                key: val for key, val in kwargs.items()
+                if key not in ('threshold', 'tolerance')}
+            smbs = [
+                compute_mass_balance(temp, prec, stdv, **params, **options)
+                for params in products]
+
+        # prepare writing all products in one pass
+        tasks = [
+            write_tile_threshold(git, tile, tilepath, smb=smb)
+            for git, smb, (_, tilepath) in zip(gits, smbs, todo)]
+
+    # estimate quadrature error on a subsample of cells
+    if kwargs.get('integration') == 'quadrature':
+        kwargs = {
+            key: val for key, val in kwargs.items()
+            if key not in ('threshold', 'kernel')}
+        error = compute_integration_error(
+            temp, prec, stdv, **todo[0][0], **kwargs)
+        tasks.append(dask.delayed(tuple)(
+            [error.max().data, error.mean().data]))
+
+    # return lazy tasks and input arrays to close after computation
+    return tasks, (temp, prec, stdv)
+
+
+def compute_tile(tile, todo, profile=False, chunks=100, **kwargs):
+    """Compute and write threshold products for a single tile."""
+
+    # compute all products in one pass
+    profiler = Profiler(enabled=profile)
+    with profiler.stage('tile', tile):
+        tasks, inputs = build_tile(
+            tile, todo, profiler=profiler, chunks=chunks, **kwargs)
+        with profiler.stage('compute', tile), profiler.tasks(tile):
+            results = dask.compute(*tasks)
+
+        # close files after computation (xarray #4131)
+        for da in inputs:
+            da.close()
+
+    # return results of the last task and profile records
+    return results[-1], profiler.records
+
+
+def report_tile(tile, todo, result=None, error=None):
+    """Report tile completion or failure."""
+    if error is not None:
+        print(f"Failed {tile}: {error!r}")
+        return
+    for _, tilepath in todo:
+        print(f"Computed {get_tile_label(tile, tilepath)}")
+    if isinstance(result, tuple):
+        print(f"Integration error {tile}: "
+              f"max {float(result[0]):.3f} K, mean {float(result[1]):.3f} K")
+
+
+def compute_tiles(
+        tiles, client=None, jobs=1, profiler=None, chunks=100, **kwargs):
+    """Compute tiles concurrently and return those that failed."""
+
+    # prepare a tile queue and a list of failures
+    queue = list(tiles)
+    failed = []
+    profiler = profiler or Profiler(enabled=False)
+    profile = profiler.enabled
+
+    # commit outputs in the main process and report completion or failure
+    def finish(tile, todo, result=None, error=None):
+        if error is None:
+            result, records = result
+            profiler.records.extend(records)
+            try:
+                with profiler.stage('commit', tile):
+                    commit_tile(tile, todo, **kwargs)
+            except OSError as err:
+                error = err
+        if error is not None:
+            failed.append(tile)
+        report_tile(tile, todo, result=result, error=error)
+
+    # compute tiles one at a time in the current process
+    if client is None and jobs == 1:
+        for tile, todo in queue:
+            try:
+                result = compute_tile(
+                    tile, todo, profile=profile, chunks=chunks, **kwargs)
+            except Exception as error:  # pylint: disable=broad-except
+                finish(tile, todo, error=error)
+            else:
+                finish(tile, todo, result=result)
+
+    # submit whole tiles to a pool of processes
+    elif client is None:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            futures = {
+                executor.submit(
+                    compute_tile, tile, todo, profile=profile,
+                    chunks=chunks, **kwargs):
+                (tile, todo) for tile, todo in queue}
+            for future in concurrent.futures.as_completed(futures):
+                tile, todo = futures[future]
+                if future.exception() is not None:
+                    finish(tile, todo, error=future.exception())
+                else:
+                    finish(tile, todo, result=future.result())
+
+    # submit tile graphs to the distributed client, keeping jobs in flight
+    else:
+        pending = dask.distributed.as_completed()
+        running = {}
+
+        # build the next tile graph while the cluster computes others
+        def submit():
+            tile, todo = queue.pop(0)
+            try:
+                with profiler.stage('build', tile):
+                    tasks, inputs = build_tile(
+                        tile, todo, profiler=profiler, chunks=chunks,
+                        **kwargs)
+            except Exception as error:  # pylint: disable=broad-except
+                finish(tile, todo, error=error)
+                return
+            future = client.compute(dask.delayed(list)(tasks))
+            running[future.key] = (tile, todo, inputs, time.perf_counter())
+            pending.add(future)
+
+        # fill the pipeline then refill it as tiles complete
+        while queue and len(running) < jobs:
+            submit()
+        for future in pending:
+            tile, todo, inputs, start = running.pop(future.key)
+            for da in inputs:
+                da.close()
+            if future.status == 'error':
+                finish(tile, todo, error=future.exception())
+            else:
+                records = [{
+                    'stage': 'compute', 'tile': tile,
+                    'wall': time.perf_counter() - start}] if profile else []
+                finish(tile, todo, result=(future.result()[-1], records))
+            while queue and len(running) < jobs:
+                submit()
+
+    # return failed tiles
+    return failed
+
+
+# Tile products
+# -------------
+
+def get_tile_path(prefix, tile, fmt='netcdf'):
+    """Get tile file path or global store path for a product."""
+    if fmt == 'zarr':
+        return f'processed/{prefix}.zarr'
+    return f'processed/{prefix}.tiles/{prefix}.{tile}.nc'
+
+
+def get_tile_label(tile, tilepath):
+    """Get tile file path or global store path and tile for messages."""
+    if tilepath.endswith('.zarr'):
+        return f'{tilepath} ({tile})'
+    return tilepath
+
+
+def get_tile_bounds(tile):
+    """Get west, south, east, north bounds of a 30x30 degree tile."""
+    south = int(tile[1:3]) * (1 if tile[0] == 'n' else -1)
+    west = int(tile[4:7]) * (1 if tile[3] == 'e' else -1)
+    return west, south, west+30, south+30
+
+
+def get_tile_region(tile, nlat, nlon):
+    """Get index slices of a 30x30 degree tile in a global grid."""
+    west, south, _, _ = get_tile_bounds(tile)
+    rows, cols = nlat // 6, nlon // 12
+    return {
+        'lat': slice((south+90)//30*rows, (south+120)//30*rows),
+        'lon': slice((west+180)//30*cols, (west+210)//30*cols)}
+
+
+def create_global_store(
+        filepath, tile, source='cw5e5', freq='day', curves=False):
+    """Pre-allocate global threshold zarr store unless already on grid."""
+
+    # get tile shape and coordinate type from input climatology
+    temp, _, _ = open_climate_tile(tile, freq=freq, source=source)
+    chunks, dtype = (temp.lat.size, temp.lon.size), temp.lat.dtype
+    temp.close()
+
+    # compute global cell centres from the nominal resolution in double
+    # precision, float32 spacings do not add up to whole tiles
+    lat = -90 + 30/chunks[0] * (np.arange(6*chunks[0]) + 0.5)
+    lon = -180 + 30/chunks[1] * (np.arange(12*chunks[1]) + 0.5)
+    lat, lon = lat.astype(dtype), lon.astype(dtype)
+
+    # keep an existing store on this grid, with its tiles and manifest
+    variables = ['git', 'smb'] if curves else ['git']
+    if os.path.isdir(filepath):
+        with xr.open_zarr(filepath) as store:
+            if store.git.shape == (lat.size, lon.size):
+                variables = [var for var in variables if var not in store]
+    if not variables:
+        return
+
+    # write metadata and coordinates only, missing chunks read as nan
+    ds = xr.Dataset(coords={'lat': lat, 'lon': lon})
+    ds['git'] = xr.DataArray(
+        dask.array.full(
+            (lat.size, lon.size), np.nan, dtype='f4', chunks=chunks),
+        dims=['lat', 'lon'],
+        attrs={'long_name': 'glacial inception threshold', 'units': 'K'})
+
+    # add mass balance curves with chunks dividing tiles
+    encoding = {}
+    if curves:
+        offset = get_temperature_offsets()
+        ds['smb'] = xr.DataArray(
+            dask.array.full(
+                (offset.size, lat.size, lon.size), np.nan, dtype='f4',
+                chunks=(1, *chunks)),
+            coords={'offset': offset}, dims=['offset', 'lat', 'lon'],
+            attrs={'long_name': 'surface mass balance', 'units': 'kg m-2'})
+        encoding['smb'] = get_curve_encoding(*chunks, fmt='zarr')
+
+    # add missing curves to an existing store, metadata only
+    if 'git' not in variables:
+        print(f"Extending {filepath} ...")
+        ds = ds[variables].drop_vars(['lat', 'lon'])
+        ds.to_zarr(filepath, mode='a', encoding=encoding, compute=False)
+        return
+
+    # otherwise allocate a new store, replacing any other grid
+    print(f"Allocating {filepath} ...")
+    ds.to_zarr(filepath, mode='w', encoding=encoding, compute=False)
+
+
+def open_tile_threshold(tile, tilepath):
+    """Open tile threshold from its own file or the global store."""
+    if tilepath.endswith('.zarr'):
+        git = xr.open_zarr(tilepath).git
+        return git.isel(get_tile_region(tile, *git.shape))
+    return xr.open_dataset(tilepath).git
+
+
+def write_tile_threshold(git, tile, tilepath, smb=None):
+    """Prepare writing tile threshold to its own file or the global store."""
+
+    # clip optional mass balance curves to their int16 encoding range
+    ds = git.astype('f4').to_dataset()
+    if smb is not None:
+        ds['smb'] = smb.astype('f4').clip(-32767, 32767).assign_attrs(
+            long_name='surface mass balance', units='kg m-2')
+
+    # write directly into the tile region of the global store
+    if tilepath.endswith('.zarr'):
+        with xr.open_zarr(tilepath) as store:
+            region = get_tile_region(tile, store.lat.size, store.lon.size)
+        ds = ds.sortby('lat').sortby('lon').chunk(lat=-1, lon=-1)
+        return ds.drop_vars(list(ds.coords)).to_zarr(
+            tilepath, region=region, compute=False)
+
+    # write a partial file, renamed when complete
+    encoding = {'git': {'zlib': True}}
+    if smb is not None:
+        encoding['smb'] = get_curve_encoding(ds.lat.size, ds.lon.size)
+    return ds.to_netcdf(tilepath + '.part', encoding=encoding, compute=False)
+
+
+def get_curve_encoding(nlat, nlon, fmt='netcdf'):
+    """Get int16 mass balance encoding chunked by offset and cell blocks."""
+
+    # use one offset per chunk and square blocks dividing the tile
+    def divisor(size, target=128):
+        return max(i for i in range(1, min(size, target)+1) if size % i == 0)
+    chunks = (1, divisor(nlat), divisor(nlon))
+
+    # quantize to 1 kg m-2, values beyond the int16 range are clipped
+    encoding = {
+        'dtype': 'i2', 'scale_factor': 1.0, 'add_offset': 0.0,
+        '_FillValue': -32768}
+    if fmt == 'zarr':
+        encoding.update(chunks=chunks, fill_value=-32768)
+    else:
+        encoding.update(zlib=True, chunksizes=chunks)
+
+    # return encoding
+    return encoding
+
+
+# Track tile products
+# -------------------
+
+def get_tile_record(
+        tile, params, source='cw5e5', freq='day', threshold=None,
+        tolerance=0.01, kernel='fused', interp=73, integration='riemann',
+        order=1, curves=False, **kwargs):
+    """Get manifest record of parameters and inputs for a tile product."""
+
+    # masked cells have no threshold either way
+    kwargs.pop('mask', None)
+
+    # record only options affecting this product, resolving the engine
+    engine = threshold
+    if engine is None:
+        engine = 'bisect' if params['precip'] == 'cp' else 'sweep'
+    options = {
+        **params, 'source': source, 'threshold': engine,
+        'integration': integration, **kwargs}
+    if source == 'cera5':
+        options['freq'] = freq
+    if integration == 'riemann':
+        options['interp'] = interp
+    if engine == 'bisect':
+        options['tolerance'] = tolerance
+    if engine == 'sweep':
+        options['kernel'] = kernel
+    if integration == 'quadrature':
+        options['order'] = order
+
+    # record input modification times and sizes, none if missing
+    inputs = {}
+    for path in get_climate_paths(tile, freq=freq, source=source):
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            inputs[path] = [stat.st_mtime, stat.st_size]
+        else:
+            inputs[path] = None
+
+    # return record as it would be read back from json
+    record = {'params': options, 'inputs': inputs, 'curves': curves}
+    return json.loads(json.dumps(record))
+
+
+def get_file_checksum(filepath):
+    """Get sha256 hex digest of a file."""
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as binfile:
+        for block in iter(lambda: binfile.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def get_tile_checksum(tile, tilepath):
+    """Get sha256 hex digest of a tile file or its global store region."""
+    if tilepath.endswith('.zarr'):
+        with open_tile_threshold(tile, tilepath) as git:
+            return hashlib.sha256(git.values.tobytes()).hexdigest()
+    return get_file_checksum(tilepath)
+
+
+def get_manifest_entry(tile, tilepath):
+    """Get manifest path and entry key for a tile product."""
+    if tilepath.endswith('.zarr'):
+        return os.path.join(tilepath, 'manifest.json'), tile
+    dirname, basename = os.path.split(tilepath)
+    return os.path.join(dirname, 'manifest.json'), basename
+
+
+def open_manifest(filepath):
+    """Open tile manifest, empty if missing."""
+    if not os.path.isfile(filepath):
+        return {}
+    with open(filepath, encoding='utf-8') as jsonfile:
+        return json.load(jsonfile)
+
+
+def save_manifest(manifest, filepath):
+    """Save tile manifest atomically."""
+    with open(filepath + '.part', 'w', encoding='utf-8') as jsonfile:
+        json.dump(manifest, jsonfile, indent=1, sort_keys=True)
+    os.replace(filepath + '.part', filepath)
+
+
+def check_tile(tile, params, tilepath, **kwargs):
+    """Check that a tile product is complete and up to date."""
+
+    # tile must exist and be listed in the manifest
+    filepath, key = get_manifest_entry(tile, tilepath)
+    entry = open_manifest(filepath).get(key)
+    if entry is None or not os.path.exists(tilepath):
+        return False
+
+    # parameters and inputs must match, curves must exist if requested,
+    # and output must not be corrupt
+    record = get_tile_record(tile, params, **kwargs)
+    return (
+        entry['params'] == record['params'] and
+        entry['inputs'] == record['inputs'] and
+        (entry.get('curves', False) or not record['curves']) and
+        entry['sha256'] == get_tile_checksum(tile, tilepath))
+
+
+def commit_tile(tile, todo, **kwargs):
+    """Rename complete tile products and record them in manifests."""
+
+    # for each product of this tile
+    for params, tilepath in todo:
+        if not tilepath.endswith('.zarr'):
+            os.replace(tilepath + '.part', tilepath)
+
+        # record parameters, inputs and output checksum, locking the
+        # manifest shared with concurrent runs on other tiles
+        filepath, key = get_manifest_entry(tile, tilepath)
+        entry = get_tile_record(tile, params, **kwargs)
+        entry['sha256'] = get_tile_checksum(tile, tilepath)
+        with open(filepath + '.lock', 'w', encoding='utf-8') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            manifest = open_manifest(filepath)
+            manifest[key] = entry
+            save_manifest(manifest, filepath)
+
+
+# Profile tile products
+# ---------------------
+
+def get_resource_usage():
+    """Get wall and cpu time, i/o bytes and peak memory of this process."""
+
+    # cpu time includes all threads, peak memory is in kB on linux
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    record = {
+        'wall': time.perf_counter(), 'cpu': usage.ru_utime+usage.ru_stime,
+        'maxrss': usage.ru_maxrss * 1024}
+
+    # bytes read and written by syscalls and from storage, linux only
+    try:
+        with open('/proc/self/io', encoding='ascii') as iofile:
+            counters = dict(line.split(': ') for line in iofile)
+        for key in ('rchar', 'wchar', 'read_bytes', 'write_bytes'):
+            record[key] = int(counters[key])
+    except OSError:
+        pass
+
+    # return resource usage
+    return record
+
+
+class Profiler():
+    """Record resource usage of pipeline stages per tile."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.records = []
+
+    @contextlib.contextmanager
+    def stage(self, name, tile=None, **labels):
+        """Record usage differences over a block, peak memory as is."""
+        if not self.enabled:
+            yield
+            return
+        start = get_resource_usage()
+        yield
+        stop = get_resource_usage()
+        self.records.append({
+            'stage': name, 'tile': tile, **labels, 'pid': os.getpid(),
+            **{key: stop[key] - start[key] for key in start
+               if key != 'maxrss'},
+            'maxrss': stop['maxrss']})
+
+    @contextlib.contextmanager
+    def tasks(self, tile=None):
+        """Record summed local dask task durations by task name."""
+        if not self.enabled:
+            yield
+            return
+        with dask.diagnostics.Profiler() as prof:
+            yield
+        self.record_tasks(
+            [(task.key, task.end_time-task.start_time)
+             for task in prof.results], tile=tile)
+
+    @contextlib.contextmanager
+    def distributed(self, client, filepath):
+        """Record distributed task durations and worker resource usage."""
+        if not self.enabled:
+            yield
+            return
+        report = contextlib.nullcontext()
+        if importlib.util.find_spec('bokeh') is None:
+            warnings.warn("Dask performance reports require bokeh.")
+        else:
+            report = dask.distributed.performance_report(filename=filepath)
+        with report, dask.distributed.get_task_stream(client) as stream:
+            yield
+        self.record_tasks([
+            (task['key'], sum(
+                span['stop']-span['start'] for span in task['startstops']
+                if span['action'] == 'compute'))
+            for task in stream.data])
+        for worker, usage in client.run(get_resource_usage).items():
+            self.records.append({'stage': 'worker', 'worker': worker, **{
+                key: val for key, val in usage.items() if key != 'wall'}})
+
+    def record_tasks(self, durations, tile=None):
+        """Record summed task durations and counts by task name."""
+        totals = {}
+        for key, seconds in durations:
+            name = dask.utils.key_split(key)
+            wall, count = totals.get(name, (0, 0))
+            totals[name] = (wall + seconds, count + 1)
+        for name, (wall, count) in sorted(totals.items()):
+            self.records.append({
+                'stage': 'task', 'tile': tile, 'task': name, 'wall': wall,
+                'count': count})
+
+    def save(self, filepath):
+        """Save records as csv or json depending on file extension."""
+
+        # csv columns are the union of record keys in order of appearance
+        if filepath.endswith('.csv'):
+            fields = list(dict.fromkeys(
+                key for record in self.records for key in record))
+            with open(filepath, 'w', encoding='utf-8', newline='') as file:
+                writer = csv.DictWriter(file, fields)
+                writer.writeheader()
+                writer.writerows(self.records)
+
+        # json also records the command line and host
+        else:
+            meta = {
+                'argv': sys.argv, 'host': platform.node(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+            with open(filepath, 'w', encoding='utf-8') as file:
+                json.dump(
+                    {'meta': meta, 'records': self.records}, file, indent=1)
+
+
+# Assemble global products
+# ------------------------
+
+def assemble_global(paths, prefix, overwrite=False, overviews=(2, 4, 8, 16)):
+    """Assemble tiles into global GeoTIFF, NetCDF and overviews in one pass."""
+
+    # reopen all tiles as lazy global dataset with one chunk per tile,
+    # not per internal netcdf chunk, so overviews and bands follow tiles
+    chunks = {'lat': -1, 'lon': -1}
+    with xr.open_mfdataset(paths, chunks=chunks) as ds, \
+            contextlib.ExitStack() as stack:
+        git = ds.git.transpose('lat', 'lon')
+        rows = np.cumsum((0,) + git.chunksizes['lat'])
+        chunks = (git.chunksizes['lat'][0], git.chunksizes['lon'][0])
+
+        # only use overview factors that evenly divide tiles
+        overviews = [
+            factor for factor in overviews if all(
+                size % factor == 0 for size in
+                git.chunksizes['lat'] + git.chunksizes['lon'])]
+
+        # list files to write, skipping existing files assembled from the
+        # same tiles unless overwriting
+        checksums = get_assembly_checksums(paths)
+        manifest = open_manifest(f'processed/{prefix}.json')
+        filepaths = {
+            f'processed/{prefix}.tif': 1, f'processed/{prefix}.nc': 1,
+            **{f'processed/{prefix}.ovr{factor}.nc': factor
+               for factor in overviews}}
+        filepaths = {
+            filepath: factor for filepath, factor in filepaths.items()
+            if overwrite or not os.path.isfile(filepath) or
+            manifest.get(filepath) != checksums}
+        if not filepaths:
+            return
+
+        # open partial files for writing
+        writers = []
+        for filepath, factor in filepaths.items():
+            print(f"Assembling {filepath} ...")
+            if filepath.endswith('.tif'):
+                writer = GeoTIFFWriter(
+                    filepath + '.part', git, overviews=overviews)
+            else:
+                writer = NetCDFWriter(
+                    filepath + '.part', coarsen_threshold(git, factor),
+                    chunks=(chunks[0]//factor, chunks[1]//factor))
+            writers.append((factor, stack.enter_context(writer)))
+
+        # stream one row of tiles at a time to all files
+        for start, stop in zip(rows[:-1], rows[1:]):
+            band = git[start:stop].load().astype('f4')
+            for factor, writer in writers:
+                writer.write(
+                    coarsen_threshold(band, factor).values, start//factor)
+
+    # rename complete files and record the tiles they were built from
+    for filepath in filepaths:
+        os.replace(filepath + '.part', filepath)
+        manifest[filepath] = checksums
+    save_manifest(manifest, f'processed/{prefix}.json')
+
+
+def get_assembly_checksums(paths):
+    """Get tile checksums from their manifests, or files if not listed."""
+    checksums = {}
+    for path in paths:
+        filepath, key = get_manifest_entry(None, path)
+        entry = open_manifest(filepath).get(key, {})
+        checksums[key] = entry.get('sha256') or get_file_checksum(path)
+    return checksums
+
+
+def coarsen_threshold(git, factor=1):
+    """Coarsen threshold by an integer factor using a NaN-aware mean."""
+    if factor == 1:
+        return git
+    return git.coarsen(lat=factor, lon=factor).mean()
+
+
+class GeoTIFFWriter():
+    """Write row bands of a global array to a tiled LZW GeoTIFF."""
+
+    def __init__(self, filepath, da, overviews=()):
+        self.overviews = list(overviews)
+        lat, lon = da.lat.values, da.lon.values
+        dlat, dlon = lat[1] - lat[0], lon[1] - lon[0]
+        transform = rasterio.transform.Affine(
+            dlon, 0, lon[0] - dlon/2, 0, dlat, lat[0] - dlat/2)
+        self.dataset = rasterio.open(
+            filepath, 'w', driver='GTiff', height=lat.size, width=lon.size,
+            count=1, dtype='float32', crs='EPSG:4326', transform=transform,
+            nodata=np.nan, compress='LZW', tiled=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if self.overviews and exc_type is None:
+            self.dataset.build_overviews(
+                self.overviews, rasterio.enums.Resampling.average)
+            self.dataset.update_tags(ns='rio_overview', resampling='average')
+        self.dataset.close()
+
+    def write(self, band, start):
+        """Write a band of rows starting at given row index."""
+        window = rasterio.windows.Window(
+            0, start, band.shape[1], band.shape[0])
+        self.dataset.write(band, 1, window=window)
+
+
+class NetCDFWriter():
+    """Write row bands of a global array to a compressed NetCDF file."""
+
+    def __init__(self, filepath, da, chunks=None):
+        self.dataset = netCDF4.Dataset(filepath, 'w')
+        for dim in da.dims:
+            self.dataset.createDimension(dim, da[dim].size)
+            var = self.dataset.createVariable(dim, da[dim].dtype, (dim,))
+            var.setncatts(da[dim].attrs)
+            var[:] = da[dim].values
+
+        # shuffle and deflate as nccopy -sd6 used to
+        self.variable = self.dataset.createVariable(
+            da.name, 'f4', da.dims, zlib=True, complevel=6, shuffle=True,
+            chunksizes=chunks, fill_value=np.nan)
+        self.variable.setncatts(da.attrs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.dataset.close()
+
+    def write(self, band, start):
+        """Write a band of rows starting at given row index."""
+        self.variable[start:start+band.shape[0]] = band
+
+
+# Query sites
+# -----------
+
+def get_tile_name(lon, lat):
+    """Get name of the 30x30 degree tile containing a point."""
+    west, south = int(lon // 30 * 30), int(lat // 30 * 30)
+    return (
+        f'{"n" if (south >= 0) else "s"}{abs(south):02d}'
+        f'{"e" if (west >= 0) else "w"}{abs(west):03d}')
+
+
+def get_site_bounds(site):
+    """Get west, south, east, north bounds of a point or polygon site."""
+    if np.ndim(site) == 1:
+        return site[0], site[1], site[0], site[1]
+    lon, lat = np.concatenate([np.asarray(ring) for ring in site]).T
+    return lon.min(), lat.min(), lon.max(), lat.max()
+
+
+def get_site_tiles(site):
+    """Get names of tiles overlapping a point or polygon site."""
+    west, south, east, north = get_site_bounds(site)
+    return {
+        get_tile_name(lon, lat)
+        for lat in range(int(south // 30 * 30), int(north)+1, 30)
+        for lon in range(int(west // 30 * 30), int(east)+1, 30)}
+
+
+def get_site_cells(site, lon, lat):
+    """Get indices of tile cells nearest a point or inside a polygon."""
+
+    # nearest cell centre to a point
+    west, south, east, north = get_site_bounds(site)
+    if np.ndim(site) == 1:
+        return [abs(lat-south).argmin()], [abs(lon-west).argmin()]
+
+    # cell centres inside polygon rings, tested within the bounding box
+    jlat = np.flatnonzero((south <= lat) & (lat <= north))
+    jlon = np.flatnonzero((west <= lon) & (lon <= east))
+    ilat, ilon = np.nonzero(get_polygon_mask(site, lon[jlon], lat[jlat]))
+    return jlat[ilat], jlon[ilon]
+
+
+def get_polygon_mask(polygon, lon, lat):
+    """Get mask of grid cell centres inside polygon rings (even-odd rule)."""
+    lon, lat = np.meshgrid(lon, lat)
+    mask = np.zeros(lon.shape, dtype=bool)
+    for ring in polygon:
+        x, y = np.asarray(ring, dtype='f8').T
+        for x0, y0, x1, y1 in zip(x, y, np.roll(x, -1), np.roll(y, -1)):
+            if y0 != y1:
+                mask ^= ((y0 > lat) != (y1 > lat)) & (
+                    lon < x0 + (lat-y0) * (x1-x0) / (y1-y0))
+    return mask
+
+
+def open_site_climate(sites, freq='day', source='cw5e5'):
+    """Open climatology on cells nearest points or inside polygons."""
+
+    # list tiles overlapping each site
+    tiles = [get_site_tiles(site) for site in sites]
+
+    # select cells tile by tile, reading only chunks that contain them
+    parts = []
+    for tile in sorted(set().union(*tiles)):
+        arrays = open_climate_tile(tile, freq=freq, source=source)
+        lon, lat = arrays[0].lon.values, arrays[0].lat.values
+        index = [
+            (i, *get_site_cells(site, lon, lat))
+            for i, site in enumerate(sites) if tile in tiles[i]]
+        site = np.concatenate([[i]*len(ilat) for i, ilat, _ in index])
+        ilat = np.concatenate([ilat for _, ilat, _ in index])
+        ilon = np.concatenate([ilon for _, _, ilon in index])
+        if site.size:
+            parts.append(dask.compute(*(
+                da.isel(
+                    lat=xr.DataArray(ilat, dims='cell'),
+                    lon=xr.DataArray(ilon, dims='cell')).assign_coords(
+                        site=('cell', site.astype(int)))
+                for da in arrays)))
+        for da in arrays:
+            da.close()
+
+    # fail if no site overlaps the climatology
+    if not parts:
+        raise ValueError("No climate cells found at sites")
+
+    # return temperature, precipitation, standard deviation by site
+    return tuple(
+        xr.concat(
+            list(arrays), dim='cell', coords='minimal', compat='override',
+            combine_attrs='override').sortby('site')
+        for arrays in zip(*parts))
+
+
+def query_sites(
+        sites, products, freq='day', source='cw5e5', curves=False,
+        **kwargs):
+    """Compute thresholds, and optionally mass balance, at sites."""
+
+    # compute thresholds on selected cells only
+    temp, prec, stdv = open_site_climate(sites, freq=freq, source=source)
+    gits = compute_ensemble(temp, prec, stdv, products, **kwargs)
+    labels = [
+        get_product_prefix(
+            source=source, dtype=kwargs.get('dtype', 'f8'), **params)
+        for params in products]
+    ds = xr.concat(gits, dim='product').assign_coords(product=labels)
+    ds = ds.to_dataset()
+
+    # add mass balance curves as a function of temperature offset
+    if curves:
+        kwargs = {
+            key: val for key, val in kwargs.items()
+            if key not in ('threshold', 'tolerance')}
+        smb = xr.concat([
+            compute_mass_balance(temp, prec, stdv, **params, **kwargs)
+            for params in products], dim='product')
+        ds['smb'] = smb.assign_coords(product=labels).assign_attrs(
+            long_name='surface mass balance', units='kg m-2')
+
+    # return computed dataset
+    return ds.compute()
+
+
 # Main program
 # ------------
 
+def get_product_prefix(
+        source='cw5e5', precip='cp', ddf=3, method='linear', dtype='f8'):
+    """Get glacial inception threshold product file name prefix."""
+    prefix = f'glopdd.git.{source}.{precip}.ddf{ddf}'
+    if method != 'linear':
+        prefix += f'.{method}'
+    if dtype != 'f8':
+        prefix += f'.{dtype}'
+    return prefix
+
+
 def main():
     """Main program called during execution."""
 
@@ -310,21 +2080,61 @@ def main():
     parser.add_argument(
         '-o', '--overwrite', action='store_true', help='replace old files')
     parser.add_argument(
-        '-d', '--ddf', default=3, type=int)
+        '-d', '--ddf', default=[3], type=int, nargs='+')
     parser.add_argument(
         '-f', '--freq', choices=['day', 'hour'], default='day')
     parser.add_argument(
         '-i', '--interp', default=73, type=int)
     parser.add_argument(
-        '-m', '--method', choices=['linear', 'stdev'], default='linear')
+        '-m', '--method', choices=['linear', 'stdv'], default=['linear'],
+        nargs='+')
     parser.add_argument(
-        '-p', '--precip', choices=['cp', 'pp'], default='cp')
+        '-p', '--precip', choices=['cp', 'pp'], default=['cp'], nargs='+')
     parser.add_argument(
         '-s', '--source', choices=['cera5', 'cw5e5'], default='cw5e5')
+    parser.add_argument(
+        '--threshold', choices=['bisect', 'sweep'], default=None,
+        help='threshold engine (default: bisect for cp, sweep for pp)')
+    parser.add_argument(
+        '--tolerance', default=0.01, type=float,
+        help='bisection tolerance in K (default: %(default)s)')
+    parser.add_argument(
+        '--kernel', choices=['fused', 'xarray'], default='fused',
+        help='mass balance kernel for the sweep (default: %(default)s)')
+    parser.add_argument(
+        '--dtype', choices=['f4', 'f8'], default='f8',
+        help='computation precision, f4 runs are compared to f8 tiles')
+    parser.add_argument(
+        '--integration', choices=['riemann', 'quadrature'], default='riemann',
+        help='annual integral as a sum over interp steps or Gauss quadrature')
+    parser.add_argument(
+        '--order', default=2, type=int,
+        help='quadrature nodes per month segment (default: %(default)s)')
+    parser.add_argument(
+        '--lookup', action='store_true',
+        help='tabulate effective temperature and error functions')
+    parser.add_argument(
+        '--no-mask', action='store_false', dest='mask',
+        help='compute all cells, even those that cannot have a threshold')
+    parser.add_argument(
+        '--curves', action='store_true',
+        help='also store int16 mass balance curves in tile products')
+    parser.add_argument(
+        '--format', choices=['netcdf', 'zarr'], default='netcdf',
+        help='tile files and global assembly, or one global zarr store')
+    parser.add_argument(
+        '--memory-per-worker', default='1GiB', metavar='SIZE',
+        help='memory per worker thread to plan chunks (default: %(default)s)')
+    parser.add_argument(
+        '--profile', metavar='PATH',
+        help='record per tile and stage resource usage to json or csv')
     parser.add_argument(
         '-t', '--tiles', action='extend', metavar='n30e000', nargs='*')
     parser.add_argument(
         '-w', '--workers', default=None, type=int)
+    parser.add_argument(
+        '-j', '--jobs', default=1, type=int,
+        help='number of tiles computed concurrently (default: %(default)s)')
     args = parser.parse_args()
 
     # warn if netCDF >= 1.6.1 (https://github.com/pydata/xarray/issues/7079)
@@ -354,61 +2164,109 @@ def main():
 
     # list climate tiles to process
     tiles = args.tiles or [
-        f'{"n" if (lat >= 0) else "s"}{abs(lat):02d}'
-        f'{"e" if (lon >= 0) else "w"}{abs(lon):03d}'
+        get_tile_name(lon, lat)
         for lat in range(-90, 90, 30) for lon in range(-180, 180, 30)]
-    prefix = f'glopdd.git.{args.source}.{args.precip}.ddf{args.ddf}'
-    paths = [f'processed/{prefix}.tiles/{prefix}.{tile}.nc' for tile in tiles]
-    os.makedirs(f'processed/{prefix}.tiles', exist_ok=True)
+
+    # aggregate global era5 stdev once, or only tile subsets as needed
+    if args.source == 'cera5' and not args.tiles:
+        aggregate_era5_std(freq='day')
+
+    # list product parameters and file name prefixes
+    products = [
+        {'ddf': ddf, 'precip': precip, 'method': method}
+        for ddf in args.ddf for precip in args.precip
+        for method in args.method]
+    prefixes = [
+        get_product_prefix(source=args.source, dtype=args.dtype, **params)
+        for params in products]
+    if args.format == 'netcdf':
+        for prefix in prefixes:
+            os.makedirs(f'processed/{prefix}.tiles', exist_ok=True)
+
+    # computation options shared by all products
+    kwargs = {
+        'source': args.source, 'freq': args.freq,
+        'threshold': args.threshold, 'tolerance': args.tolerance,
+        'kernel': args.kernel, 'mask': args.mask, 'interp': args.interp,
+        'integration': args.integration, 'order': args.order,
+        'lookup': args.lookup, 'dtype': args.dtype, 'curves': args.curves}
+
+    # plan spatial chunks for the most memory-hungry threshold engine,
+    # mass balance curves are always computed by an offset sweep
+    chunks = plan_chunks(
+        memory=args.memory_per_worker, interp=args.interp,
+        integration=args.integration, order=args.order, kernel=args.kernel,
+        sweep=args.curves or args.threshold == 'sweep' or (
+            args.threshold is None and 'pp' in args.precip),
+        dtype=args.dtype)
+
+    # list products missing, stale or corrupt for each tile
+    profiler = Profiler(enabled=args.profile is not None)
+    queue = []
+    for tile in tiles:
+        todo = [
+            (params, get_tile_path(prefix, tile, fmt=args.format))
+            for params, prefix in zip(products, prefixes)]
+        with profiler.stage('check', tile):
+            todo = [
+                (params, tilepath) for params, tilepath in todo
+                if args.overwrite or
+                not check_tile(tile, params, tilepath, **kwargs)]
+        if todo:
+            queue.append((tile, todo))
+
+    # pre-allocate global stores so that tiles write their own regions,
+    # overwriting only replaces the regions of queued tiles
+    if args.format == 'zarr' and queue:
+        for prefix in prefixes:
+            create_global_store(
+                get_tile_path(prefix, None, fmt='zarr'), queue[0][0],
+                source=args.source, freq=args.freq, curves=args.curves)
 
     # start distributed client of progress bar
-    with Context(**options):
-
-        # for each tile and corresponding path
-        for tile, tilepath in zip(tiles, paths):
-
-            # unless file exists
-            if args.overwrite or not os.path.isfile(tilepath):
-
-                # compute glacial threshold
-                print(f"Computing {tilepath} ...")
-                temp, prec, stdv = open_climate_tile(
-                    tile, freq=args.freq, source=args.source)
-                smb = compute_mass_balance(
-                    temp, prec, stdv, ddf=args.ddf, interp=args.interp,
-                    method=args.method, precip=args.precip)
-                git = compute_glacial_threshold(smb)
-                git.astype('f4').to_netcdf(
-                    tilepath, encoding={'git': {'zlib': True}})
-
-                # close files after computation (xarray #4131)
-                for da in temp, prec, stdv:
-                    da.close()
-
-        # reopen all tiles as global dataset
-        with xr.open_mfdataset(paths) as ds:
-
-            # save compressed geotiff
-            filepath = f'processed/{prefix}.tif'
-            if args.overwrite or not os.path.isfile(filepath):
-                print(f"Assembling {filepath} ...")
-                git = ds.git.rio.set_spatial_dims(x_dim='lon', y_dim='lat')
-                git.rio.to_raster(filepath, compress='LZW', tiled=True)
-
-            # save uncompressed netcdf
-            filepath = f'processed/{prefix}.nc'
-            if args.overwrite or not os.path.isfile(filepath):
-                print(f"Assembling {filepath} ...")
-                ds.to_netcdf(filepath)
-
-                # nccopy compression beats xarray by far
-                print(f"Compressing {filepath} ...")
-                dirname, basename = os.path.split(filepath)
-                with tempfile.NamedTemporaryFile(
-                        dir=dirname, prefix=basename+'.') as tmp:
-                    subprocess.run(
-                        ['nccopy', '-sd6', filepath, tmp.name])
-                    os.replace(tmp.name, filepath)
+    with Context(**options) as context:
+        client = context if args.workers is not None else None
+
+        # compute missing tiles concurrently, with a performance report
+        report = contextlib.nullcontext()
+        if client is not None and args.profile:
+            report = profiler.distributed(
+                client, os.path.splitext(args.profile)[0] + '.html')
+        with report:
+            failed = compute_tiles(
+                queue, client=client, jobs=args.jobs, profiler=profiler,
+                chunks=chunks, **kwargs)
+        if args.profile:
+            profiler.save(args.profile)
+
+        # do not assemble incomplete products
+        if failed:
+            sys.exit(f"Failed to compute tiles {' '.join(failed)}")
+
+        # for each product
+        for params, prefix in zip(products, prefixes):
+            paths = [
+                get_tile_path(prefix, tile, fmt=args.format)
+                for tile in tiles]
+
+            # compare reduced precision tiles to double precision reference
+            if args.dtype != 'f8':
+                refprefix = get_product_prefix(source=args.source, **params)
+                refpaths = [
+                    get_tile_path(refprefix, tile, fmt=args.format)
+                    for tile in tiles]
+                filepath = f'processed/{prefix}.diff.csv'
+                print(f"Reporting {filepath} ...")
+                report_threshold_diff(tiles, paths, refpaths, filepath)
+
+            # assemble global products, zarr tiles are already in place
+            if args.format == 'netcdf':
+                with profiler.stage('assemble', product=prefix):
+                    assemble_global(paths, prefix, overwrite=args.overwrite)
+
+        # save profile including assembly
+        if args.profile:
+            profiler.save(args.profile)
 
 
 if __name__ == '__main__':
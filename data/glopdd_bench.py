@@ -0,0 +1,291 @@
+#!/usr/bin/python
+# Copyright (c) 2024, Julien Seguinot (juseg.dev)
+# Creative Commons Attribution-ShareAlike 4.0 International License
+# (CC BY-SA 4.0, http://creativecommons.org/licenses/by-sa/4.0/)
+
+"""Benchmark glacial inception threshold computation kernels."""
+
+import argparse
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import time
+import dask
+import dask.array
+import numpy as np
+import scipy.special as sc
+import xarray as xr
+import glopdd
+
+
+# Micro-benchmarks
+# ----------------
+
+def benchmark_function(func, x, repeat=5):
+    """Return best time in seconds over several calls."""
+    func(x)  # warm-up, also builds lookup tables
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(x)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def benchmark_lookup(size=1000000, repeat=5, dtype='f8'):
+    """Compare exact and tabulated special function throughput."""
+
+    # normalized temperatures spanning cold to hot climates
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-10, 30, size).astype(dtype)
+
+    # for each tabulated function
+    results = []
+    for name, exact in (('teff', glopdd.calov_greve), ('erfc', sc.erfc)):
+        table = glopdd.get_lookup_table(name)
+
+        # measure throughput and relative error where the table applies
+        inside = (table.start <= x) & (x <= table.stop)
+        error = abs(table(x) - exact(x))[inside] / abs(exact(x))[inside]
+        for method, func in (('exact', exact), ('table', table)):
+            seconds = benchmark_function(func, x, repeat=repeat)
+            results.append({
+                'function': name, 'method': method, 'dtype': dtype,
+                'rate': size / seconds,
+                'error': 0.0 if method == 'exact' else float(error.max())})
+
+    # return list of results
+    return results
+
+
+# Synthetic tiles
+# ---------------
+
+def synthetic_tile(size=360, chunks=100, seed=0, dtype='f8'):
+    """Generate synthetic monthly temp, prec and stdv on a 30-degree tile."""
+
+    # cell centre coordinates on the n30e000 tile, 3600 is 30 arc seconds
+    res = 30 / size
+    lat = 60 - res * (np.arange(size) + 0.5)
+    lon = res * (np.arange(size) + 0.5)
+    month = np.arange(1, 13)
+
+    # random climates from polar to tropical with a seasonal cycle
+    rng = dask.array.random.RandomState(seed)
+    shape, blocks = (size, size), (chunks, chunks)
+    cycle = np.cos(2*np.pi*(month-7)/12)[:, None, None]
+    temp = (
+        rng.uniform(-25, 30, shape, chunks=blocks) +
+        rng.uniform(0, 15, shape, chunks=blocks) * cycle)
+    prec = rng.uniform(0, 8, (12, *shape), chunks=(12, *blocks))
+    stdv = rng.uniform(1, 6, (12, *shape), chunks=(12, *blocks))
+
+    # wrap as data arrays and keep them in memory
+    coords = {'month': month, 'lat': lat, 'lon': lon}
+    arrays = (
+        xr.DataArray(
+            x.astype(dtype), coords=coords, dims=['month', 'lat', 'lon'],
+            name=name, attrs={'units': units})
+        for x, name, units in (
+            (temp, 'temp', 'degC'), (prec, 'prec', 'kg m-2 day-1'),
+            (stdv, 'stdv', 'K')))
+    temp, prec, stdv = dask.persist(*arrays, scheduler='threads')
+
+    # return synthetic climate
+    return temp, prec, stdv
+
+
+# Pipeline benchmarks
+# -------------------
+
+def get_stage_task(stage, temp, prec, stdv, chunks=100, interp=73):
+    """Return lazy outputs of a pipeline stage on synthetic inputs."""
+
+    # interpolate at the requested chunk size, as compute_interp_inputs
+    params = {'ddf': 3, 'precip': 'cp', 'method': 'linear'}
+    kwargs = {'interp': interp, 'dtype': temp.dtype}
+    daily = [
+        glopdd.compute_interp_climate(
+            da.chunk(lat=chunks, lon=chunks), **kwargs).chunk(day=-1)
+        for da in (temp, prec, stdv)]
+
+    # reduce large intermediate outputs to avoid keeping them in memory
+    if stage == 'interp':
+        return [da.sum() for da in daily]
+    if stage == 'mask':
+        return [glopdd.compute_candidate_mask(
+            temp, prec, stdv, interp=interp, **params)]
+    if stage == 'balance':
+        return [glopdd.compute_mass_balance(
+            *daily, **params, **kwargs).sum()]
+    if stage == 'sweep':
+        return [glopdd.compute_glacial_threshold(
+            glopdd.compute_mass_balance(*daily, **params, **kwargs))]
+    if stage == 'bisect':
+        return [glopdd.compute_bisect_threshold(
+            *daily, **params, **kwargs)]
+
+    # full pipeline with candidate masks as in build_tile
+    if stage == 'pipeline':
+        masks = dask.compute(glopdd.compute_candidate_mask(
+            temp, prec, stdv, interp=interp, **params))
+        return glopdd.compute_ensemble(
+            *daily, [params], masks=list(masks), **kwargs)
+    raise ValueError(f"Invalid stage {stage}")
+
+
+def benchmark_stage(
+        stage, size=360, chunks=100, interp=73, scheduler='threads',
+        dtype='f8'):
+    """Time one pipeline stage on a synthetic tile in this process."""
+
+    # generate inputs outside the timed section
+    temp, prec, stdv = synthetic_tile(size=size, chunks=chunks, dtype=dtype)
+
+    # time graph construction and computation, in wall and cpu seconds
+    wall, cpu = time.perf_counter(), time.process_time()
+    with dask.config.set(scheduler=scheduler):
+        tasks = get_stage_task(
+            stage, temp, prec, stdv, chunks=chunks, interp=interp)
+        dask.compute(*tasks)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    # peak resident memory in this process and its workers, in kB on linux
+    rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    # return results and parameters
+    return {
+        'stage': stage, 'size': size, 'chunks': chunks, 'interp': interp,
+        'scheduler': scheduler, 'dtype': dtype, 'seconds': wall,
+        'cpu': cpu, 'rate': size**2 / wall, 'maxrss': rss * 1024}
+
+
+def benchmark_pipeline(
+        stages, sizes=(360,), chunks=(100,), interps=(73,),
+        schedulers=('threads',), dtype='f8'):
+    """Time pipeline stages across sizes, chunks, interp and schedulers."""
+
+    # run each case in a fresh process so that peak memory is per case
+    context = multiprocessing.get_context('spawn')
+    cases = itertools.product(sizes, chunks, interps, schedulers, stages)
+    for size, chunk, interp, scheduler, stage in cases:
+        with concurrent.futures.ProcessPoolExecutor(
+                1, mp_context=context) as executor:
+            yield executor.submit(
+                benchmark_stage, stage, size=size, chunks=min(chunk, size),
+                interp=interp, scheduler=scheduler, dtype=dtype).result()
+
+
+# Benchmark records
+# -----------------
+
+def get_benchmark_meta():
+    """Return commit, host and library versions for a benchmark record."""
+
+    # try to read current commit, it may not be a git checkout
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    # return metadata
+    return {
+        'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'host': platform.node(), 'cpus': os.cpu_count(),
+        'python': platform.python_version(), 'dask': dask.__version__,
+        'numpy': np.__version__, 'xarray': xr.__version__}
+
+
+def save_benchmark(results, filepath):
+    """Save benchmark results and metadata to a json file."""
+    with open(filepath, 'w', encoding='utf-8') as file:
+        json.dump(
+            {'meta': get_benchmark_meta(), 'results': results}, file,
+            indent=1)
+
+
+# Main program
+# ------------
+
+def main():
+    """Main program called during execution."""
+
+    # parse command-line arguments
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--size', default=1000000, type=int)
+    parser.add_argument('-r', '--repeat', default=5, type=int)
+    parser.add_argument(
+        '--dtype', choices=['f4', 'f8'], default=['f4', 'f8'], nargs='+')
+    parser.add_argument(
+        '--stages', default=['lookup'], nargs='+',
+        choices=['lookup', 'interp', 'mask', 'balance', 'sweep', 'bisect',
+                 'pipeline'],
+        help='benchmarks to run, later stages include interp '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--tiles', default=[120, 360], type=int, nargs='+',
+        help='synthetic tile sizes, 3600 is 30 arc seconds '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--chunks', default=[100], type=int, nargs='+',
+        help='horizontal chunk sizes (default: %(default)s)')
+    parser.add_argument(
+        '--interp', default=[73], type=int, nargs='+',
+        help='interpolation steps per year (default: %(default)s)')
+    parser.add_argument(
+        '--scheduler', default=['threads'], nargs='+',
+        choices=['threads', 'processes', 'synchronous'],
+        help='dask schedulers (default: %(default)s)')
+    parser.add_argument(
+        '--output', metavar='bench.json',
+        help='save results as json to compare between commits')
+    args = parser.parse_args()
+    results = []
+
+    # run lookup table micro-benchmark
+    if 'lookup' in args.stages:
+        print(f"{'function':<8} {'method':<6} {'dtype':<5} "
+              f"{'Melem/s':>8} {'max rel err':>11}")
+        for dtype in args.dtype:
+            for res in benchmark_lookup(
+                    size=args.size, repeat=args.repeat, dtype=dtype):
+                print(f"{res['function']:<8} {res['method']:<6} "
+                      f"{res['dtype']:<5} {res['rate']/1e6:8.1f} "
+                      f"{res['error']:11.2e}")
+                results.append({'stage': 'lookup', **res})
+
+    # run pipeline benchmarks on synthetic tiles
+    stages = [stage for stage in args.stages if stage != 'lookup']
+    if stages:
+        print(f"{'stage':<8} {'size':>5} {'chunks':>6} {'interp':>6} "
+              f"{'scheduler':<11} {'dtype':<5} {'seconds':>8} "
+              f"{'kcells/s':>8} {'MiB':>6}")
+        for dtype in args.dtype:
+            for res in benchmark_pipeline(
+                    stages, sizes=args.tiles, chunks=args.chunks,
+                    interps=args.interp, schedulers=args.scheduler,
+                    dtype=dtype):
+                print(f"{res['stage']:<8} {res['size']:5d} "
+                      f"{res['chunks']:6d} {res['interp']:6d} "
+                      f"{res['scheduler']:<11} {res['dtype']:<5} "
+                      f"{res['seconds']:8.2f} {res['rate']/1e3:8.1f} "
+                      f"{res['maxrss']/2**20:6.0f}")
+                results.append(res)
+
+    # save results for comparison between commits
+    if args.output:
+        save_benchmark(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
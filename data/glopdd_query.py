@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# Copyright (c) 2024, Julien Seguinot (juseg.dev)
+# Creative Commons Attribution-ShareAlike 4.0 International License
+# (CC BY-SA 4.0, http://creativecommons.org/licenses/by-sa/4.0/)
+
+"""Query glacial inception thresholds at points and in polygons."""
+
+import argparse
+import csv
+import json
+import sys
+import glopdd
+
+
+# Read sites
+# ----------
+
+def read_points(filepath):
+    """Read lon, lat points and their attributes from a csv file."""
+
+    # read rows skipping comment lines
+    with open(filepath, encoding='utf-8') as csvfile:
+        rows = list(csv.DictReader(
+            line for line in csvfile if not line.startswith('#')))
+
+    # find coordinate columns by name
+    names = {key.lower(): key for key in rows[0]}
+    lon = next(names[key] for key in ('lon', 'longitude', 'x') if key in names)
+    lat = next(names[key] for key in ('lat', 'latitude', 'y') if key in names)
+
+    # return points and attributes
+    points = [(float(row[lon]), float(row[lat])) for row in rows]
+    return points, rows
+
+
+def read_polygons(filepath):
+    """Read polygon rings and their properties from a geojson file."""
+
+    # read features
+    with open(filepath, encoding='utf-8') as jsonfile:
+        features = json.load(jsonfile)['features']
+
+    # flatten multipolygon rings, holes follow from the even-odd rule
+    polygons, rows = [], []
+    for feature in features:
+        geometry = feature['geometry']
+        if geometry['type'] == 'Polygon':
+            polygons.append(geometry['coordinates'])
+        elif geometry['type'] == 'MultiPolygon':
+            polygons.append([
+                ring for polygon in geometry['coordinates']
+                for ring in polygon])
+        else:
+            raise ValueError(f"Invalid geometry type {geometry['type']}")
+        rows.append(feature.get('properties') or {})
+
+    # return polygons and properties
+    return polygons, rows
+
+
+# Write results
+# -------------
+
+def write_table(ds, rows, file):
+    """Write one row per site cell and product with site attributes."""
+    fields = list(dict.fromkeys(key for row in rows for key in row))
+    writer = csv.writer(file)
+    writer.writerow(fields + ['cell_lon', 'cell_lat', 'product', 'git'])
+    for i, site in enumerate(ds.site.values):
+        for product in ds['product'].values:
+            writer.writerow(
+                [rows[site].get(key, '') for key in fields] + [
+                    f'{ds.lon.values[i]:.6f}', f'{ds.lat.values[i]:.6f}',
+                    product, f'{ds.git.sel(product=product).values[i]:.3f}'])
+
+
+# Main program
+# ------------
+
+def main():
+    """Main program called during execution."""
+
+    # parse command-line arguments
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--points', metavar='sites.csv',
+        help='csv file with lon, lat or longitude, latitude columns')
+    parser.add_argument(
+        '--point', action='append', default=[], nargs=2, type=float,
+        metavar=('LON', 'LAT'), help='single point, can be repeated')
+    parser.add_argument(
+        '--polygons', metavar='catchments.geojson',
+        help='geojson file with polygon features, all cells inside')
+    parser.add_argument(
+        '-o', '--output', metavar='thresholds.csv',
+        help='threshold table (default: standard output)')
+    parser.add_argument(
+        '--curves', metavar='curves.nc',
+        help='also write mass balance curves for each site cell')
+    parser.add_argument(
+        '-d', '--ddf', default=[3], type=int, nargs='+')
+    parser.add_argument(
+        '-f', '--freq', choices=['day', 'hour'], default='day')
+    parser.add_argument(
+        '-i', '--interp', default=73, type=int)
+    parser.add_argument(
+        '-m', '--method', choices=['linear', 'stdv'], default=['linear'],
+        nargs='+')
+    parser.add_argument(
+        '-p', '--precip', choices=['cp', 'pp'], default=['cp'], nargs='+')
+    parser.add_argument(
+        '-s', '--source', choices=['cera5', 'cw5e5'], default='cw5e5')
+    parser.add_argument(
+        '--threshold', choices=['bisect', 'sweep'], default=None,
+        help='threshold engine (default: bisect for cp, sweep for pp)')
+    args = parser.parse_args()
+
+    # read sites and their attributes
+    sites = [tuple(point) for point in args.point]
+    rows = [{'lon': lon, 'lat': lat} for lon, lat in sites]
+    for filepath, reader in (
+            (args.points, read_points), (args.polygons, read_polygons)):
+        if filepath:
+            more, attrs = reader(filepath)
+            sites += more
+            rows += attrs
+    if not sites:
+        parser.error("no sites given, use --point, --points or --polygons")
+
+    # compute thresholds and optional mass balance curves
+    products = [
+        {'ddf': ddf, 'precip': precip, 'method': method}
+        for ddf in args.ddf for precip in args.precip
+        for method in args.method]
+    ds = glopdd.query_sites(
+        sites, products, freq=args.freq, source=args.source,
+        curves=args.curves is not None, threshold=args.threshold,
+        interp=args.interp)
+
+    # write threshold table and mass balance curves
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as file:
+            write_table(ds, rows, file)
+    else:
+        write_table(ds, rows, sys.stdout)
+    if args.curves:
+        ds.to_netcdf(args.curves)
+
+
+if __name__ == '__main__':
+    main()
@@ -55,14 +55,13 @@ def plot(source='cw5e5'):
     # open global inception threshold and PMIP4 LGM temperature change
     with (
             glopdd_utils.open_inception_threshold(source=source) as git,
+            glopdd_utils.open_inception_threshold(
+                source=source, max_pixels=2**22) as ovr,
             open_pmip_anomaly() as lgm):
 
-        # interpolate PMIP LGM anomaly to CHELSA grid
-        lgm = lgm.interp_like(git)
-
-        # plot global inception areas
-        gia = git > lgm
-        gia.isel(lat=slice(0, -1, 10), lon=slice(0, -1, 10)).plot.imshow(
+        # plot global inception areas on the overview grid
+        gia = ovr > lgm.interp_like(ovr)
+        gia.plot.imshow(
                 ax=ax, add_labels=False, add_colorbar=False,
                 cmap=mpl.colors.ListedColormap(['#ffffff', 'tab:blue']))
 
@@ -76,6 +75,7 @@ def plot(source='cw5e5'):
         # select american cordilleras
         west, south, east, north = -135, -60, -60, 45
         git = git.sel(lat=slice(south, north), lon=slice(west, east))
+        lgm = lgm.interp_like(git)
 
         # mark inset
         ax.indicate_inset(
@@ -6,9 +6,9 @@
 """Plot global PDD glacial inception threshold."""
 
 import numpy as np
-import xarray as xr
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+import glopdd_utils
 
 def main():
     """Main program called during execution."""
@@ -21,14 +21,17 @@ def main():
         [14/36, 6.5/18, 5/36, 5/18],
         [24.5/36, 5/18, 5/36, 5/18])]
     cax = fig.add_axes([17/36, 4.5/18, 5/36, .5/18])
-    kwargs = {'cmap': cmaps('Oranges', 'Blues'), 'vmin': -20, 'vmax': 0}
+    kwargs = glopdd_utils.get_plot_kwargs(source='cw5e5')
 
-    # open glacial inception threshold
-    with xr.open_dataarray('../data/processed/glopdd.git.cw5e5.nc') as git:
+    # open glacial inception threshold and overview for the world map
+    with (
+            glopdd_utils.open_inception_threshold(source='cw5e5') as git,
+            glopdd_utils.open_inception_threshold(
+                source='cw5e5', max_pixels=2**22) as ovr):
         # git = git.where((-12 < git)*(git < 0))
 
         # plot global map
-        git.isel(lat=slice(0, -1, 10), lon=slice(0, -1, 10)).plot.imshow(
+        ovr.plot.imshow(
             ax=ax0, add_labels=False, cbar_ax=cax, cbar_kwargs={
                 'label': 'glacial inception threshold (K)',
                 'orientation': 'horizontal'}, **kwargs)
@@ -7,7 +7,10 @@
 
 import argparse
 import contextlib
+import fcntl
+import glob
 import itertools
+import json
 import multiprocessing
 import os.path
 import sys
@@ -112,22 +115,157 @@ def open_inception_threshold_duo(source='sdiff'):
         yield (da0, da1)
 
 
-def open_inception_threshold(source='cw5e5', precip='cp', ddf=3):
-    """Open glacial inception threshold."""
-    if source == 'fdiff':
-        return (
-            open_inception_threshold(source='cw5e5', precip=precip, ddf=5) -
-            open_inception_threshold(source='cw5e5', precip=precip, ddf=2))
-    if source == 'pdiff':
-        return (
-            open_inception_threshold(source='cw5e5', precip='pp', ddf=ddf) -
-            open_inception_threshold(source='cw5e5', precip='cp', ddf=ddf))
-    if source == 'sdiff':
-        return (
-            open_inception_threshold(source='cera5', precip=precip, ddf=ddf) -
-            open_inception_threshold(source='cw5e5', precip=precip, ddf=ddf))
-    da = xr.open_dataarray(
-        f'../data/processed/glopdd.git.{source}.{precip}.ddf{ddf}.nc',
-        chunks={})
+def open_inception_threshold(
+        source='cw5e5', precip='cp', ddf=3, level=0, max_pixels=None):
+    """Open glacial inception threshold at full or overview resolution.
+
+    Overview levels 1 to 4 are coarsened 2, 4, 8 and 16 times, lazily from
+    full resolution if no overview file exists, as in zarr stores. If
+    max_pixels is given, use the finest level from the requested one with no
+    more pixels. Difference sources are computed once and cached next to
+    their inputs.
+    """
+
+    # list full resolution and overview files by level
+    if source in ('fdiff', 'pdiff', 'sdiff'):
+        paths = cache_threshold_diff(source, precip=precip, ddf=ddf)
+    else:
+        prefix = f'../data/processed/glopdd.git.{source}.{precip}.ddf{ddf}'
+        paths = [get_level_path(prefix, 2**i) for i in range(5)]
+
+    # full resolution must exist, overviews are optional
+    if not os.path.exists(paths[0]):
+        raise FileNotFoundError(f"No such file or directory: {paths[0]}")
+
+    # use requested level or the finest coarser level within pixel budget
+    if max_pixels is not None:
+        with open_threshold_file(paths[0]) as da:
+            pixels = da.size
+        while level < len(paths)-1 and pixels > max_pixels * 4**level:
+            level += 1
+
+    # open overview file or coarsen full resolution
+    da = open_threshold_level(paths, level=level)
+    da = da.sortby(da.lat, ascending=True)
+    return da
+
+
+def get_level_path(prefix, factor=1):
+    """Get global store, full resolution or overview file path."""
+    if factor == 1 and os.path.isdir(prefix + '.zarr'):
+        return prefix + '.zarr'
+    if factor == 1:
+        return prefix + '.nc'
+    return f'{prefix}.ovr{factor}.nc'
+
+
+def open_threshold_file(path):
+    """Open glacial inception threshold from a zarr store or netcdf file."""
+    if path.endswith('.zarr'):
+        return xr.open_zarr(path).git
+    return xr.open_dataarray(path, chunks={})
+
+
+def open_threshold_level(paths, level=0):
+    """Open threshold overview file, or coarsen full resolution if missing."""
+    if os.path.exists(paths[level]):
+        return open_threshold_file(paths[level])
+    factor = 2**level
+    da = open_threshold_file(paths[0])
+    return da.coarsen(lat=factor, lon=factor, boundary='trim').mean(
+        keep_attrs=True)
+
+
+def cache_threshold_diff(source='sdiff', precip='cp', ddf=3):
+    """Compute threshold difference levels unless cached and up to date."""
+
+    # get product names of the cached difference and its two terms
+    name, *terms = {
+        'fdiff': (
+            f'fdiff.{precip}', ('cw5e5', precip, 5), ('cw5e5', precip, 2)),
+        'pdiff': (
+            f'pdiff.ddf{ddf}', ('cw5e5', 'pp', ddf), ('cw5e5', 'cp', ddf)),
+        'sdiff': (
+            f'sdiff.{precip}.ddf{ddf}', ('cera5', precip, ddf),
+            ('cw5e5', precip, ddf))}[source]
+    prefixes = [
+        '../data/processed/glopdd.git.{}.{}.ddf{}'.format(*term)
+        for term in terms]
+    prefix = f'../data/processed/glopdd.git.{name}'
+
+    # list cached and term levels, full resolution and overviews
+    paths = [get_level_path(prefix, 2**i) for i in range(5)]
+    levels = [
+        [get_level_path(term, 2**i) for i in range(5)] for term in prefixes]
+
+    # record input modification times and sizes of full resolution and
+    # existing overviews, the zarr manifest is rewritten whenever a tile is
+    # committed to the global store
+    inputs = {}
+    for term in levels:
+        for path in term[:1] + [path for path in term[1:]
+                                if os.path.isfile(path)]:
+            if path.endswith('.zarr'):
+                path = os.path.join(path, 'manifest.json')
+            stat = os.stat(path)
+            inputs[path] = [stat.st_mtime, stat.st_size]
+    inputs = json.loads(json.dumps(inputs))
+
+    # lock so that concurrent figures compute each difference only once
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    with open(prefix + '.lock', 'w', encoding='utf-8') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+
+        # reuse cached files if their record matches current inputs
+        record = None
+        if os.path.isfile(prefix + '.json'):
+            with open(prefix + '.json', encoding='utf-8') as jsonfile:
+                record = json.load(jsonfile)
+        if record == inputs and all(map(os.path.isfile, paths)):
+            return paths
+
+        # write partial files from term overviews or coarsened terms
+        for level, path in enumerate(paths):
+            print(f"Caching {path} ...")
+            with open_threshold_level(levels[0], level=level) as da0, \
+                    open_threshold_level(levels[1], level=level) as da1:
+                diff = (da0 - da1).rename('git').assign_attrs(
+                    long_name='glacial inception threshold difference',
+                    units='K')
+                diff.to_netcdf(
+                    path + '.part', encoding={'git': {'zlib': True}})
+            os.replace(path + '.part', path)
+
+        # record inputs last so that interrupted runs are recomputed
+        with open(prefix + '.json.part', 'w', encoding='utf-8') as jsonfile:
+            json.dump(inputs, jsonfile, indent=1, sort_keys=True)
+        os.replace(prefix + '.json.part', prefix + '.json')
+
+    # return cached file paths by level
+    return paths
+
+
+def open_mass_balance(source='cw5e5', precip='cp', ddf=3, offset=None):
+    """Open surface mass balance curves, or a slice at a temperature offset.
+
+    Curves are only stored in tile products computed with --curves. Reading
+    a single offset or a single cell only decompresses matching chunks.
+    """
+
+    # open global store or all tiles as one lazy dataset
+    prefix = f'glopdd.git.{source}.{precip}.ddf{ddf}'
+    dirname = '../data/processed'
+    if os.path.isdir(f'{dirname}/{prefix}.zarr'):
+        ds = xr.open_zarr(f'{dirname}/{prefix}.zarr')
+    else:
+        ds = xr.open_mfdataset(
+            sorted(glob.glob(f'{dirname}/{prefix}.tiles/{prefix}.*.nc')))
+    if 'smb' not in ds:
+        raise ValueError(f"No mass balance curves in {prefix} products.")
+
+    # select nearest temperature offset if requested
+    da = ds.smb
+    if offset is not None:
+        da = da.sel(offset=offset, method='nearest')
     da = da.sortby(da.lat, ascending=True)
     return da
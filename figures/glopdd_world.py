@@ -26,11 +26,14 @@ def plot(source='cw5e5'):
     label = glopdd_utils.get_plot_title(source=source)
     props = glopdd_utils.get_plot_kwargs(source=source)
 
-    # open global inception threshold
-    with glopdd_utils.open_inception_threshold(source=source) as da:
+    # open global inception threshold and overview for the world map
+    with (
+            glopdd_utils.open_inception_threshold(source=source) as da,
+            glopdd_utils.open_inception_threshold(
+                source=source, max_pixels=2**22) as ovr):
 
         # plot global map
-        da.isel(lat=slice(0, -1, 10), lon=slice(0, -1, 10)).plot.imshow(
+        ovr.plot.imshow(
             ax=ax0, add_labels=False, cbar_ax=cax, cbar_kwargs={
                 'label': label, 'orientation': 'horizontal'}, **props)
 